@@ -6,15 +6,6 @@ import math
 from visualize.const import *
 
 def get_camera_params(camera_no):
-    camera_params = [
-        # azimuth, text
-        [0,      "cam00"],
-        [20,     "cam01"],
-        [-20,    "cam02"],
-        [180,    "cam03"],
-        [200,    "cam04"],
-        [160,    "cam05"],
-    ]
     if camera_no == -1: # all cameras
         return camera_params
     elif camera_no < len(camera_params):
@@ -0,0 +1,65 @@
+import bpy
+import os
+import json
+
+from blender.camera import prepare_camera_settings
+from blender.utils import setup_render_settings, render_animation, cleanup_existing_objects, parse_arguments, load_info, setup_background_scene
+from blender.utils import create_body_collection, remove_body_collection, get_pending_cameras
+from blender.render_smpl import load_bodies
+from visualize.const import *
+
+def load_jobs(jobs_path):
+    """Read the job list, each job is {input, output, target, soft, camera}"""
+    with open(jobs_path) as f:
+        return json.load(f)
+
+def main():
+    args = parse_arguments()
+    jobs = load_jobs(args.jobs)
+
+    # Blender was started with the scene file, set it up once for all jobs
+    cleanup_existing_objects()
+    setup_render_settings(args.high)
+    setup_background_scene(args.scene)
+
+    # camera settings are derived from the initial camera, which rendering moves
+    camera = bpy.context.scene.camera
+    initial_location = camera.location.copy()
+    initial_rotation = camera.rotation_euler.copy()
+
+    body_key, collection, num_frames = None, None, 0
+    for job_i, job in enumerate(jobs):
+        obj_folder = job['input']
+        render_target = job['target']
+        soft = job.get('soft', False)
+        print(f"Job {job_i + 1}/{len(jobs)}: {video_name_per_flag[render_target]} from {obj_folder}")
+
+        video_dir = job.get('output')
+        if video_dir is None:
+            video_dir = os.path.join(VIDEO_DIR, 'smpl_' + os.path.basename(obj_folder))
+        os.makedirs(video_dir, exist_ok=True)
+
+        camera.location = initial_location
+        camera.rotation_euler = initial_rotation
+        root_loc1, root_loc2 = load_info(obj_folder)
+        camera_settings = prepare_camera_settings(root_loc1, root_loc2, job.get('camera', -1))
+        camera_settings = get_pending_cameras(video_dir, render_target, camera_settings)
+        if not camera_settings:
+            print(f"All videos of job {job_i + 1} exist, skipping")
+            continue
+
+        # swap the body collection only when the bodies change
+        if body_key != (obj_folder, render_target, soft):
+            if collection is not None:
+                remove_body_collection(collection)
+            collection = create_body_collection(f"Bodies_{video_name_per_flag[render_target]}")
+            num_frames = load_bodies(obj_folder, render_target, soft, args.single_mesh)
+            body_key = (obj_folder, render_target, soft)
+
+        render_animation(video_dir, render_target, camera_settings, num_frames, args.shard, args.num_shards, args.frames)
+
+    if collection is not None:
+        remove_body_collection(collection)
+
+if __name__ == "__main__":
+    main()
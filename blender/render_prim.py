@@ -1,12 +1,17 @@
 import bpy
+import bmesh
 import os
 import numpy as np
 
 from blender.camera import prepare_camera_settings
-from blender.utils import setup_render_settings, setup_animation_settings, render_animation, cleanup_existing_objects, parse_arguments, setup_keyframes, setup_background_scene
+from blender.utils import setup_render_settings, setup_animation_settings, render_animation, cleanup_existing_objects, parse_arguments, setup_background_scene, set_keyframes
+from blender.utils import create_rigid_animated_mesh
 from visualize.const import *
 from blender.prim import *
 
+# template meshes of the instanced joints and bones, {(kind, material): mesh}
+template_meshes = {}
+
 def create_mesh_for_frame(verts, faces, frame_num, material):
     """Create mesh object for a specific frame"""
     # Create new mesh datablock
@@ -17,8 +22,8 @@ def create_mesh_for_frame(verts, faces, frame_num, material):
     mesh.from_pydata(verts, [], faces)
     mesh.update()
     
-    # Link object to scene
-    bpy.context.scene.collection.objects.link(obj)
+    # Link object to the active collection, like the joint and bone primitives
+    bpy.context.collection.objects.link(obj)
     
     # Add material
     obj.data.materials.append(bpy.data.materials[material])
@@ -91,6 +96,44 @@ def create_bone_cone(joint1_pos, joint2_pos, material, bone_idx, radius=0.03):
     
     return cone
 
+def get_template_mesh(kind, material):
+    """Unit sphere or cylinder mesh built once per material with bmesh, shared by its linked duplicates"""
+    key = (kind, material)
+    if key not in template_meshes:
+        bm = bmesh.new()
+        if kind == 'sphere':
+            bmesh.ops.create_uvsphere(bm, u_segments=32, v_segments=16, radius=1)
+        else:
+            bmesh.ops.create_cone(bm, cap_ends=True, segments=32, radius1=1, radius2=1, depth=1)
+            # same cuts the operator path adds with subdivide
+            bmesh.ops.subdivide_edges(bm, edges=bm.edges[:], cuts=10, use_grid_fill=True)
+        for face in bm.faces:
+            face.smooth = True
+        mesh = bpy.data.meshes.new(f"{kind}_{material}_template")
+        bm.to_mesh(mesh)
+        bm.free()
+        mesh.materials.append(bpy.data.materials[material])
+        template_meshes[key] = mesh
+    return template_meshes[key]
+
+def create_sphere_instance(material, joint_idx, radius=0.05):
+    """Linked duplicate of the template sphere, scaled to the joint radius"""
+    joint_radius = joint_radii.get(joint_idx, radius)
+    sphere = bpy.data.objects.new(f"Joint_{joint_idx}", get_template_mesh('sphere', material))
+    sphere.scale = (joint_radius, joint_radius, joint_radius)
+    bpy.context.collection.objects.link(sphere)
+    return sphere
+
+def create_bone_instance(joint1_pos, joint2_pos, material, bone_idx, radius=0.03):
+    """Linked duplicate of the template cylinder, scaled to the bone radius and first frame length"""
+    length = np.linalg.norm(joint2_pos - joint1_pos)
+    cone = bpy.data.objects.new(f"Bone_{bone_idx}", get_template_mesh('cylinder', material))
+    cone.scale = (radius, radius, length)
+    cone.location = (joint1_pos + joint2_pos) / 2
+    cone.rotation_mode = 'AXIS_ANGLE'
+    bpy.context.collection.objects.link(cone)
+    return cone
+
 def load_data(obj_folder):
     """Load and validate data from npz file"""
     npz_file = os.path.join(obj_folder, PRIM_FILE_NAME)
@@ -102,83 +145,83 @@ def load_data(obj_folder):
 
 def create_joints_and_bones(p1_joints, p2_joints, material1, material2):
     """Create joint spheres and bone cones for both characters"""
+    create_sphere = create_sphere_instance if PRIM_INSTANCED else create_sphere_for_joint
+    create_bone = create_bone_instance if PRIM_INSTANCED else create_bone_cone
+    
     # Create spheres for p1 joints
-    p1_spheres = [create_sphere_for_joint(material1, i) for i in range(p1_joints.shape[1])]
+    p1_spheres = [create_sphere(material1, i) for i in range(p1_joints.shape[1])]
     # Create spheres for p2 joints  
-    p2_spheres = [create_sphere_for_joint(material2, i) for i in range(p2_joints.shape[1])]
+    p2_spheres = [create_sphere(material2, i) for i in range(p2_joints.shape[1])]
     
     # Create bones for p1
     p1_bones = []
     for bone_idx, (joint1, joint2) in bone_pair.items():
-        cone = create_bone_cone(p1_joints[0, joint1], p1_joints[0, joint2], material1, bone_idx, bone_radius[bone_idx])
+        cone = create_bone(p1_joints[0, joint1], p1_joints[0, joint2], material1, bone_idx, bone_radius[bone_idx])
         p1_bones.append((cone, joint1, joint2))
         
     # Create bones for p2
     p2_bones = []
     for bone_idx, (joint1, joint2) in bone_pair.items():
-        cone = create_bone_cone(p2_joints[0, joint1], p2_joints[0, joint2], material2, bone_idx, bone_radius[bone_idx])
+        cone = create_bone(p2_joints[0, joint1], p2_joints[0, joint2], material2, bone_idx, bone_radius[bone_idx])
         p2_bones.append((cone, joint1, joint2))
         
     return p1_spheres, p2_spheres, p1_bones, p2_bones
 
-def create_object_meshes(verts_list, obj_faces_list, material):
-    """Create mesh objects for each frame"""
-    print("Creating object meshes...")
-    num_frames = len(verts_list)*2-1
-    for frame_num in range(1, num_frames+1):
-        # Create mesh for the frame
-        if frame_num == num_frames:
-            verts = verts_list[-1]
-        elif frame_num % 2 == 0:
-            verts = verts_list[frame_num//2]
-        else:
-            verts = (verts_list[frame_num//2] + verts_list[frame_num//2+1]) / 2
-        obj = create_mesh_for_frame(verts, obj_faces_list, frame_num, material)
-        setup_keyframes(obj, frame_num)
+def create_object_mesh(verts_list, obj_faces_list, material):
+    """Create one object mesh with a shape key per frame, blended linearly between frames"""
+    print("Creating object mesh...")
+    obj = create_mesh_for_frame(verts_list[0], obj_faces_list, 1, material)
+    obj.name = "Object"
+    obj.shape_key_add(name="Basis", from_mix=False)
+    
+    anim_frames = np.arange(len(verts_list)) * 2 + 1
+    for frame_i, (verts, anim_frame) in enumerate(zip(verts_list, anim_frames)):
+        shape_key = obj.shape_key_add(name=f"Frame_{frame_i}", from_mix=False)
+        shape_key.data.foreach_set('co', np.asarray(verts, dtype=np.float32).ravel())
+        # full weight on its own frame, fading out towards the neighbouring ones
+        set_keyframes(obj.data.shape_keys, f'key_blocks["{shape_key.name}"].value',
+                      anim_frame + np.array([-2, 0, 2]), [0, 1, 0], interpolation='LINEAR')
+    return obj
 
-def update_joints_and_bones(frame_num, p1_joints, p2_joints, p1_spheres, p2_spheres, p1_bones, p2_bones):
-    """Update joint and bone positions for a frame"""
-    anim_frame = frame_num * 2 + 1
-    
-    # Update p1 joints and bones
-    for sphere, pos in zip(p1_spheres, p1_joints[frame_num]):
-        sphere.location = pos
-        sphere.keyframe_insert(data_path="location", frame=anim_frame)
-    
-    for cone, joint1, joint2 in p1_bones:
-        joint1_pos = p1_joints[frame_num, joint1]
-        joint2_pos = p1_joints[frame_num, joint2]
-        update_bone_position(cone, joint1_pos, joint2_pos, anim_frame)
-        
-    # Update p2 joints and bones
-    for sphere, pos in zip(p2_spheres, p2_joints[frame_num]):
-        sphere.location = pos
-        sphere.keyframe_insert(data_path="location", frame=anim_frame)
-    
-    for cone, joint1, joint2 in p2_bones:
-        joint1_pos = p2_joints[frame_num, joint1]
-        joint2_pos = p2_joints[frame_num, joint2]
-        update_bone_position(cone, joint1_pos, joint2_pos, anim_frame)
+def create_rigid_object(rest_verts, transforms, obj_faces_list, material):
+    """Create the object mesh once and key its transform per frame"""
+    print("Creating rigid object...")
+    anim_frames = np.arange(len(transforms)) * 2 + 1
+    return create_rigid_animated_mesh("Object", rest_verts, transforms, obj_faces_list, material, anim_frames)
 
-def update_bone_position(cone, joint1_pos, joint2_pos, frame):
-    """Update position and rotation of a bone cone"""
-    cone.location = (joint1_pos + joint2_pos) / 2
-    
-    # Update rotation
+def get_bone_rotations(joint1_pos, joint2_pos):
+    """Axis-angle rotations [F, 4] turning the z axis onto the bone direction of each frame"""
     direction = joint2_pos - joint1_pos
-    length = np.linalg.norm(direction)
-    direction = direction / length
+    direction = direction / np.linalg.norm(direction, axis=-1, keepdims=True)
     
     z_axis = np.array([0, 0, 1])
     rotation_axis = np.cross(z_axis, direction)
-    rotation_angle = np.arccos(np.dot(z_axis, direction))
-    
-    if np.any(rotation_axis):
-        cone.rotation_mode = 'AXIS_ANGLE'
-        cone.rotation_axis_angle = [rotation_angle] + list(rotation_axis)
-    
-    cone.keyframe_insert(data_path="location", frame=frame)
-    cone.keyframe_insert(data_path="rotation_axis_angle", frame=frame)
+    rotation_angle = np.arccos(np.clip(direction @ z_axis, -1, 1))
+    rotations = np.concatenate([rotation_angle[:, None], rotation_axis], axis=-1)
+    
+    # bones along z keep the rotation of the previous frame, the identity before the first one
+    rotations = np.concatenate([[[0, 0, 1, 0]], rotations])
+    valid = np.concatenate([[True], np.any(rotation_axis, axis=-1)])
+    previous = np.maximum.accumulate(np.where(valid, np.arange(len(valid)), 0))
+    return rotations[previous][1:]
+
+def animate_bone(cone, joint1_pos, joint2_pos, frames):
+    """Key position and rotation of a bone cone at all frames"""
+    cone.rotation_mode = 'AXIS_ANGLE'
+    set_keyframes(cone, "location", frames, (joint1_pos + joint2_pos) / 2)
+    set_keyframes(cone, "rotation_axis_angle", frames, get_bone_rotations(joint1_pos, joint2_pos))
+
+def animate_joints_and_bones(num_frames, p1_joints, p2_joints, p1_spheres, p2_spheres, p1_bones, p2_bones):
+    """Key joint and bone positions of all frames, one fcurve fill per channel"""
+    anim_frames = np.arange(num_frames) * 2 + 1
+    
+    for joints, spheres, bones in [(p1_joints, p1_spheres, p1_bones), (p2_joints, p2_spheres, p2_bones)]:
+        joints = joints[:num_frames]
+        for joint_idx, sphere in enumerate(spheres):
+            set_keyframes(sphere, "location", anim_frames, joints[:, joint_idx])
+        
+        for cone, joint1, joint2 in bones:
+            animate_bone(cone, joints[:, joint1], joints[:, joint2], anim_frames)
 
 def load_data_for_target(obj_folder, render_target):
     """Load data based on render target flag"""
@@ -193,17 +236,24 @@ def load_data_for_target(obj_folder, render_target):
     for key in keys_to_load:
         if key in data:
             loaded_data[key] = data[key]
+        elif key + RIGID_REST_SUFFIX in data:
+            # rigid object stored as a rest mesh and a transform track
+            loaded_data[key + RIGID_REST_SUFFIX] = data[key + RIGID_REST_SUFFIX]
+            loaded_data[key + RIGID_TRANSFORMS_SUFFIX] = data[key + RIGID_TRANSFORMS_SUFFIX]
         else:
             raise KeyError(f"Required key '{key}' not found in data file")
             
     return loaded_data
 
 def prepare_render_data(data, render_target):
-    vert_keys = [key for key in data.keys() if 'verts_list' in key.lower()]
+    vert_keys = [key for key in data.keys() if key.lower().endswith('verts_list') or key.endswith(RIGID_REST_SUFFIX)]
     if len(vert_keys) != 1:
         raise ValueError(f"Expected exactly one vert list key, found {len(vert_keys)}: {vert_keys}")
     verts_list = data[vert_keys[0]]
-    num_frames = len(verts_list)
+    obj_transforms = None
+    if vert_keys[0].endswith(RIGID_REST_SUFFIX):
+        obj_transforms = data[vert_keys[0][:-len(RIGID_REST_SUFFIX)] + RIGID_TRANSFORMS_SUFFIX]
+    num_frames = len(verts_list) if obj_transforms is None else len(obj_transforms)
     
     obj_faces_list = data[KEY_OBJ_FACES]
     
@@ -223,7 +273,7 @@ def prepare_render_data(data, render_target):
         p2_joints = data[p2_keys[0]]
         num_frames = min(num_frames,len(p1_joints), len(p2_joints))
     
-    return verts_list, obj_faces_list, p1_joints, p2_joints, num_frames
+    return verts_list, obj_transforms, obj_faces_list, p1_joints, p2_joints, num_frames
 
 def main():
     args = parse_arguments()
@@ -248,7 +298,7 @@ def main():
     setup_background_scene(scene_no)
     
     # Prepare render data
-    verts_list, obj_faces_list, p1_joints, p2_joints, num_frames = prepare_render_data(data, render_target)
+    verts_list, obj_transforms, obj_faces_list, p1_joints, p2_joints, num_frames = prepare_render_data(data, render_target)
     materials = ["Yellow", "Red", "Blue"] if not soft else ["Yellow_soft", "Red_soft", "Blue_soft"]
         
     setup_animation_settings(num_frames*2-1)
@@ -258,14 +308,16 @@ def main():
         # Create joints and bones
         p1_spheres, p2_spheres, p1_bones, p2_bones = create_joints_and_bones(p1_joints, p2_joints, materials[1], materials[2])
     
-    # Create object meshes
-    create_object_meshes(verts_list, obj_faces_list, materials[0])
+    # Create object mesh
+    if obj_transforms is not None:
+        create_rigid_object(verts_list, obj_transforms, obj_faces_list, materials[0])
+    else:
+        create_object_mesh(verts_list, obj_faces_list, materials[0])
     
     # Update joint and bone positions if they exist
     if p1_joints is not None and p2_joints is not None:
         print("Updating joint positions and bones...")
-        for frame_num in range(num_frames):
-            update_joints_and_bones(frame_num, p1_joints, p2_joints, p1_spheres, p2_spheres, p1_bones, p2_bones)
+        animate_joints_and_bones(num_frames, p1_joints, p2_joints, p1_spheres, p2_spheres, p1_bones, p2_bones)
     
     # Create output directory and render
     if video_dir is None:
@@ -275,7 +327,7 @@ def main():
     
     # Render animation
     camera_settings = prepare_camera_settings(root_loc1, root_loc2, camera_no)
-    render_animation(video_dir, render_target, camera_settings, num_frames*2-1)
+    render_animation(video_dir, render_target, camera_settings, num_frames*2-1, args.shard, args.num_shards, args.frames)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -4,6 +4,8 @@ import numpy as np
 
 from blender.camera import prepare_camera_settings
 from blender.utils import setup_render_settings, setup_animation_settings, stdout_redirected, render_animation, cleanup_existing_objects, parse_arguments, setup_keyframes, load_info, setup_background_scene
+from blender.utils import convert_to_blender_coordinates, load_obj_arrays, create_vertex_animated_mesh, create_rigid_animated_mesh
+from visualize.rigid import transforms_to_blender_coordinates
 from visualize.const import *
 
 def import_and_setup_frame(obj_paths, files, materials, frame_num):
@@ -24,21 +26,98 @@ def import_and_setup_frame(obj_paths, files, materials, frame_num):
     for obj in imported_objs:
         setup_keyframes(obj, frame_num)
 
+def load_vertex_sequence(obj_path):
+    """Load the exported (vertices, faces, transforms) of one body, None if it was exported as objs.
+    Rigid objects have rest vertices [V, 3] and transforms [F, 4, 4], the others vertices [F, V, 3] and no transforms."""
+    faces_path = os.path.join(obj_path, FACES_FILE_NAME)
+    rest_path = os.path.join(obj_path, RIGID_REST_FILE_NAME)
+    transforms_path = os.path.join(obj_path, RIGID_TRANSFORMS_FILE_NAME)
+    sequence_path = os.path.join(obj_path, SEQUENCE_FILE_NAME)
+    if not os.path.exists(faces_path):
+        return None
+    if os.path.exists(rest_path) and os.path.exists(transforms_path):
+        return np.load(rest_path), np.load(faces_path), np.load(transforms_path)
+    if os.path.exists(sequence_path):
+        return np.load(sequence_path, mmap_mode='r'), np.load(faces_path), None
+    return None
+
+def load_vertex_sequences(obj_paths):
+    """Load exported sequences per body, None if any body was exported as objs"""
+    sequences = [load_vertex_sequence(obj_path) for obj_path in obj_paths]
+    if any(sequence is None for sequence in sequences):
+        return None
+    return sequences
+
+def get_sequence_length(sequence):
+    vertex_frames, _, transforms = sequence
+    return len(vertex_frames) if transforms is None else len(transforms)
+
+def load_obj_sequences(obj_paths, obj_files, num_frames):
+    """Read the per-frame objs of each body into a vertex sequence and faces"""
+    sequences = []
+    for obj_path, files in zip(obj_paths, obj_files):
+        _, faces = load_obj_arrays(os.path.join(obj_path, files[0]))
+        vertex_frames = np.stack([load_obj_arrays(os.path.join(obj_path, file_name))[0]
+                                  for file_name in files[:num_frames]])
+        sequences.append((vertex_frames, faces, None))
+    return sequences
+
+def create_vertex_animated_meshes(obj_paths, sequences, materials, num_frames):
+    """Create one mesh per body and drive its vertices from its vertex sequence"""
+    for obj_path, (vertex_frames, faces, transforms), material in zip(obj_paths, sequences, materials):
+        if transforms is not None:
+            rest_verts = convert_to_blender_coordinates(vertex_frames).astype(np.float32)
+            transforms = transforms_to_blender_coordinates(transforms[:num_frames])
+            create_rigid_animated_mesh(os.path.basename(obj_path), rest_verts, transforms, faces, material)
+        else:
+            vertex_frames = convert_to_blender_coordinates(vertex_frames[:num_frames]).astype(np.float32)
+            create_vertex_animated_mesh(os.path.basename(obj_path), vertex_frames, faces, material)
+        print(f"Loaded {num_frames} frames for {os.path.basename(obj_path)}")
+
 def prepare_obj_paths_and_materials(obj_folder, render_target, soft):
     objs = [key_path_map[key] for key in keys_to_render_per_flag[render_target]]
     materials = ["Yellow", "Red", "Blue"] if not soft else ["Yellow_soft", "Red_soft", "Blue_soft"]
     materials = materials[:len(objs)]
     
     obj_paths = [os.path.join(obj_folder, obj) for obj in objs]
-    obj_files = [sorted(f for f in os.listdir(path) if f.endswith('.obj')) for path in obj_paths]
     
     # Check if all object paths exist
     for path in obj_paths:
         if not os.path.exists(path):
             raise FileNotFoundError(f"Object path does not exist: {path}")
     
+    obj_files = [sorted(f for f in os.listdir(path) if f.endswith('.obj')) for path in obj_paths]
+    
     return obj_paths, obj_files, materials
 
+def load_bodies(obj_folder, render_target, soft, single_mesh):
+    """Add the bodies of one render target to the scene and set the frame range, returns the number of frames"""
+    # Prepare object paths and materials
+    print(f"Preparing for {obj_folder}...")
+    obj_paths, obj_files, materials = prepare_obj_paths_and_materials(obj_folder, render_target, soft)
+    
+    sequences = load_vertex_sequences(obj_paths)
+    if sequences is not None:
+        num_frames = min(get_sequence_length(sequence) for sequence in sequences)
+    else:
+        num_frames = min(len(files) for files in obj_files)
+    setup_animation_settings(num_frames)
+    
+    if sequences is not None or single_mesh:
+        if sequences is None:
+            sequences = load_obj_sequences(obj_paths, obj_files, num_frames)
+        create_vertex_animated_meshes(obj_paths, sequences, materials, num_frames)
+        bpy.context.scene.frame_set(1)
+    else:
+        # Process each frame
+        for i, files in enumerate(zip(*obj_files)):
+            frame_num = i + 1
+            import_and_setup_frame(obj_paths, files, materials, frame_num)
+            progress = frame_num / len(obj_files[0]) * 100
+            print(f"\rImporting objs: [{('=' * int(progress/2)).ljust(50)}] {progress:.1f}%", end='', flush=True)
+        print()
+    return num_frames
+
 def main():
     args = parse_arguments()
     obj_folder = args.input
@@ -48,29 +127,17 @@ def main():
     camera_no = args.camera
     soft = args.soft
     scene_no = args.scene
+    single_mesh = args.single_mesh
     
     root_loc1, root_loc2 = load_info(obj_folder)
     
-    # Prepare object paths and materials
-    print(f"Preparing for {obj_folder}...")
-    obj_paths, obj_files, materials = prepare_obj_paths_and_materials(obj_folder, render_target, soft)
-    
     # Load scene and setup
     bpy.ops.wm.open_mainfile(filepath=BLENDER_PATH)
     cleanup_existing_objects()
     setup_render_settings(render_high)
     setup_background_scene(scene_no)
     
-    num_frames = min(len(files) for files in obj_files)
-    setup_animation_settings(num_frames)
-    
-    # Process each frame
-    for i, files in enumerate(zip(*obj_files)):
-        frame_num = i + 1
-        import_and_setup_frame(obj_paths, files, materials, frame_num)
-        progress = frame_num / len(obj_files[0]) * 100
-        print(f"\rImporting objs: [{('=' * int(progress/2)).ljust(50)}] {progress:.1f}%", end='', flush=True)
-    print()
+    num_frames = load_bodies(obj_folder, render_target, soft, single_mesh)
     
     # Create output directory
     if video_dir is None:
@@ -80,7 +147,7 @@ def main():
     
     # Render animation
     camera_settings = prepare_camera_settings(root_loc1, root_loc2, camera_no)
-    render_animation(video_dir, render_target, camera_settings, num_frames)
+    render_animation(video_dir, render_target, camera_settings, num_frames, args.shard, args.num_shards, args.frames)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -5,8 +5,13 @@ import threading
 import argparse
 from contextlib import contextmanager
 from visualize.const import *
+from visualize.rigid import matrix_to_quaternion
 import numpy as np
 import math
+
+# frame change handlers of vertex animated meshes, by object name
+vertex_handlers = {}
+
 @contextmanager
 def stdout_redirected(keyword=None, on_match=None):
     """
@@ -59,6 +64,11 @@ def parse_arguments():
     parser.add_argument('-c', '--camera', type=int, help='Camera number, default=-1 for all cameras', default=-1)
     parser.add_argument('-sc', '--scene', type=int, help='Scene number, default=0 for no furnitures', default=0)
     parser.add_argument('-s', '--soft', action='store_true', help='Use soft material')
+    parser.add_argument('-sm', '--single_mesh', action='store_true', help='Animate one mesh per body instead of one object per frame')
+    parser.add_argument('-j', '--jobs', type=str, help='JSON job list for render_batch.py')
+    parser.add_argument('--frames', action='store_true', help='Render resumable png frames to be encoded afterwards instead of a video')
+    parser.add_argument('--shard', type=int, help='Index of the frame range shard to render', default=0)
+    parser.add_argument('--num_shards', type=int, help='Number of frame range shards, >1 renders png frames instead of a video', default=1)
     
     return parser.parse_args(argv)
 
@@ -80,25 +90,140 @@ def cleanup_existing_objects():
         for obj in sample_collection.objects:
             bpy.data.objects.remove(obj, do_unlink=True)
 
+def get_action(obj):
+    """Action of an object or other ID such as shape keys, created on first use"""
+    if obj.animation_data is None:
+        obj.animation_data_create()
+    if obj.animation_data.action is None:
+        obj.animation_data.action = bpy.data.actions.new(f"{obj.name}_action")
+    return obj.animation_data.action
+
+def set_keyframes(obj, data_path, frames, values, interpolation=None):
+    """Key a property at all frames at once, one fcurve per channel filled with foreach_set.
+
+    Args:
+        obj: object or other ID to animate, without keys on data_path yet
+        data_path: animated property, e.g. "location"
+        frames: frame numbers [K]
+        values: values [K] of a scalar property or [K, C] of an array property
+        interpolation: keyframe interpolation, None keeps the default one
+    """
+    action = get_action(obj)
+    frames = np.asarray(frames, dtype=np.float32)
+    values = np.asarray(values, dtype=np.float32).reshape(len(frames), -1)
+    coords = np.empty((len(frames), 2), dtype=np.float32)
+    coords[:, 0] = frames
+    if interpolation is not None:
+        # foreach_set takes the enum value, not its identifier
+        enum_items = bpy.types.Keyframe.bl_rna.properties['interpolation'].enum_items
+        interpolations = np.full(len(frames), enum_items[interpolation].value, dtype=np.int32)
+    for index in range(values.shape[1]):
+        fcurve = action.fcurves.new(data_path, index=index)
+        coords[:, 1] = values[:, index]
+        fcurve.keyframe_points.add(len(frames))
+        fcurve.keyframe_points.foreach_set('co', coords.ravel())
+        if interpolation is not None:
+            fcurve.keyframe_points.foreach_set('interpolation', interpolations)
+        # sorts the keys and computes the bezier handles
+        fcurve.update()
+
 def setup_keyframes(obj, frame_num):
     """Set up keyframes for visibility of object"""
-    # Hide at start
+    # hidden at start, shown at frame_num and hidden again after it, on frame 1 the later key wins
+    keys = {1: True, frame_num: False, frame_num + 1: True}
+    for data_path in ("hide_render", "hide_viewport"):
+        set_keyframes(obj, data_path, list(keys), list(keys.values()), interpolation='CONSTANT')
     obj.hide_render = True
     obj.hide_viewport = True
-    obj.keyframe_insert(data_path="hide_render", frame=1)
-    obj.keyframe_insert(data_path="hide_viewport", frame=1)
+
+def convert_to_blender_coordinates(verts):
+    """Y-up OBJ coordinates to Blender's Z-up, as done by the OBJ importer"""
+    return np.stack([verts[..., 0], -verts[..., 2], verts[..., 1]], axis=-1)
+
+def load_obj_arrays(file_path):
+    """Read vertices and triangle faces (0-based) of an OBJ file as numpy arrays"""
+    with open(file_path) as f:
+        lines = f.read().splitlines()
+    verts = np.array([line.split()[1:4] for line in lines if line.startswith('v ')], dtype=np.float32)
+    faces = np.array([[int(idx.split('/')[0]) - 1 for idx in line.split()[1:4]]
+                      for line in lines if line.startswith('f ')], dtype=np.int32)
+    return verts, faces
+
+def create_vertex_animated_mesh(name, vertex_frames, faces, material):
+    """Create one mesh whose vertices are replaced from vertex_frames [F, V, 3] on frame change"""
+    mesh = bpy.data.meshes.new(f"{name}_mesh")
+    mesh.from_pydata(vertex_frames[0], [], faces)
+    mesh.update()
+    obj = bpy.data.objects.new(name, mesh)
+    bpy.context.collection.objects.link(obj)
+    obj.data.materials.append(bpy.data.materials[material])
+    with bpy.context.temp_override(selected_editable_objects=[obj]):
+        bpy.ops.object.shade_smooth()
     
-    # Show at current frame
-    obj.hide_render = False
-    obj.hide_viewport = False
-    obj.keyframe_insert(data_path="hide_render", frame=frame_num)
-    obj.keyframe_insert(data_path="hide_viewport", frame=frame_num)
+    def update_vertices(scene, depsgraph=None):
+        frame_i = min(max(scene.frame_current - 1, 0), len(vertex_frames) - 1)
+        mesh.vertices.foreach_set('co', vertex_frames[frame_i].ravel())
+        mesh.update()
     
-    # Hide at next frame
-    obj.hide_render = True
-    obj.hide_viewport = True
-    obj.keyframe_insert(data_path="hide_render", frame=frame_num + 1)
-    obj.keyframe_insert(data_path="hide_viewport", frame=frame_num + 1)
+    bpy.app.handlers.frame_change_pre.append(update_vertices)
+    vertex_handlers[obj.name] = update_vertices
+    # handlers must not run while the render thread reads the scene
+    bpy.context.scene.render.use_lock_interface = True
+    return obj
+
+def set_transform_keyframes(obj, frames, transforms, interpolation=None):
+    """Key the object location and rotation from rigid transforms [F, 4, 4].
+    Between keys Blender blends the normalized quaternions, so the object stays rigid."""
+    obj.rotation_mode = 'QUATERNION'
+    set_keyframes(obj, "location", frames, transforms[:, :3, 3], interpolation)
+    set_keyframes(obj, "rotation_quaternion", frames, matrix_to_quaternion(transforms[:, :3, :3]), interpolation)
+
+def create_rigid_animated_mesh(name, rest_verts, transforms, faces, material, frames=None, interpolation='LINEAR'):
+    """Create one mesh from its rest vertices and move it by keying the object transform, frames default to 1..F"""
+    mesh = bpy.data.meshes.new(f"{name}_mesh")
+    mesh.from_pydata(rest_verts, [], faces)
+    mesh.update()
+    obj = bpy.data.objects.new(name, mesh)
+    bpy.context.collection.objects.link(obj)
+    obj.data.materials.append(bpy.data.materials[material])
+    with bpy.context.temp_override(selected_editable_objects=[obj]):
+        bpy.ops.object.shade_smooth()
+    
+    if frames is None:
+        frames = np.arange(len(transforms)) + 1
+    set_transform_keyframes(obj, frames, transforms, interpolation)
+    return obj
+
+def create_body_collection(name):
+    """Create a collection for one target's bodies and make it the one new objects are linked to"""
+    collection = bpy.data.collections.new(name)
+    bpy.context.scene.collection.children.link(collection)
+    view_layer = bpy.context.view_layer
+    view_layer.active_layer_collection = view_layer.layer_collection.children[collection.name]
+    return collection
+
+def remove_body_collection(collection):
+    """Remove a body collection with its objects, meshes, actions and frame change handlers"""
+    action_names = set()
+    for obj in list(collection.objects):
+        handler = vertex_handlers.pop(obj.name, None)
+        if handler in bpy.app.handlers.frame_change_pre:
+            bpy.app.handlers.frame_change_pre.remove(handler)
+        mesh = obj.data
+        # actions made by get_action on the object, its mesh or its shape keys
+        for owner in (obj, mesh, getattr(mesh, 'shape_keys', None)):
+            if owner is not None and owner.animation_data is not None and owner.animation_data.action is not None:
+                action_names.add(owner.animation_data.action.name)
+        bpy.data.objects.remove(obj, do_unlink=True)
+        if mesh is not None and mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+    for name in action_names:
+        action = bpy.data.actions.get(name)
+        if action is not None and action.users == 0:
+            bpy.data.actions.remove(action)
+    bpy.data.collections.remove(collection)
+    view_layer = bpy.context.view_layer
+    view_layer.active_layer_collection = view_layer.layer_collection
 
 def setup_background_scene(scene_no):
     """Setup background scene"""
@@ -185,7 +310,7 @@ def setup_high_quality_settings():
 
 def setup_animation_settings(num_frames):
     """Configure animation and frame settings"""
-    bpy.context.scene.render.fps = 30
+    bpy.context.scene.render.fps = VIDEO_FPS
     bpy.context.scene.render.fps_base = 1
     bpy.context.scene.frame_start = 1
     bpy.context.scene.frame_end = num_frames
@@ -215,16 +340,72 @@ def setup_camera_setting(camera_setting):
     if sun:
         sun.rotation_euler = light_rotation
 
-def render_animation(video_dir, render_target, camera_settings, num_frames):
-    """Render animation from different camera angles"""
+def get_shard_range(num_frames, shard, num_shards):
+    """First and last frame (1-based, inclusive) of a contiguous shard of the animation"""
+    shard_size = -(-num_frames // num_shards)
+    return shard * shard_size + 1, min((shard + 1) * shard_size, num_frames)
+
+def get_video_path(video_dir, render_target, camera_setting):
+    return os.path.join(video_dir, video_name_per_flag[render_target] + "_" + camera_setting['text'] + VIDEO_EXT)
+
+def get_frames_dir(video_path):
+    return os.path.splitext(video_path)[0] + FRAMES_DIR_SUFFIX
+
+def get_pending_cameras(video_dir, render_target, camera_settings):
+    """Camera settings whose video has not been rendered yet"""
+    return [camera_setting for camera_setting in camera_settings
+            if not os.path.exists(get_video_path(video_dir, render_target, camera_setting))]
+
+def setup_image_sequence_output(frames_dir, frame_start, frame_end):
+    """Write each frame as a png, skipping frames already on disk so interrupted renders resume"""
+    bpy.context.scene.render.image_settings.file_format = 'PNG'
+    bpy.context.scene.render.image_settings.color_mode = 'RGB'
+    bpy.context.scene.render.use_overwrite = False
+    bpy.context.scene.render.use_placeholder = True
+    
+    # an interrupted render leaves its placeholder empty, render that frame again
+    os.makedirs(frames_dir, exist_ok=True)
+    for frame in range(frame_start, frame_end + 1):
+        frame_path = os.path.join(frames_dir, f"{FRAME_FILE_PREFIX}{frame:04d}{FRAME_FILE_EXT}")
+        if os.path.exists(frame_path) and os.path.getsize(frame_path) == 0:
+            os.remove(frame_path)
+    
+    # all shards write into the same frames directory, numbered by scene frame
+    bpy.context.scene.render.filepath = os.path.join(frames_dir, FRAME_FILE_PREFIX + '####')
+
+def render_animation(video_dir, render_target, camera_settings, num_frames, shard=0, num_shards=1, frames=False):
+    """Render animation from different camera angles, skipping cameras whose video exists.
+    
+    With frames or more than one shard, this shard's frame range is rendered as pngs to be encoded later.
+    """
+    frames = frames or num_shards > 1
+    frame_start, frame_end = get_shard_range(num_frames, shard, num_shards)
+    bpy.context.scene.frame_start = frame_start
+    bpy.context.scene.frame_end = frame_end
+    if frame_start > frame_end:
+        print(f"Shard {shard} of {num_shards} has no frames to render")
+        return
+    num_frames = frame_end - frame_start + 1
+    
+    os.makedirs(video_dir, exist_ok=True)
     for camera_setting in camera_settings:
-        video_name = video_name_per_flag[render_target] + "_" + camera_setting['text'] + ".mp4"
-        os.makedirs(video_dir, exist_ok=True)
-        bpy.context.scene.render.filepath = os.path.join(video_dir, video_name)
+        video_path = get_video_path(video_dir, render_target, camera_setting)
+        if os.path.exists(video_path):
+            print(f"Skipping {video_path}, already rendered")
+            continue
+        
+        if frames:
+            setup_image_sequence_output(get_frames_dir(video_path), frame_start, frame_end)
+        else:
+            # render under a temporary name so an interrupted render never looks finished
+            partial_path = os.path.splitext(video_path)[0] + PARTIAL_SUFFIX + VIDEO_EXT
+            bpy.context.scene.render.filepath = partial_path
         setup_camera_setting(camera_setting)
         
         print(f"Rendering {num_frames} frames for {camera_setting['text']}...")
         with stdout_redirected(keyword="Fra:", on_match=lambda line: line[:-1].encode()):
             bpy.ops.render.render(animation=True)
         print()
-        print(f"Saved to {video_dir} for {video_name_per_flag[render_target]} {camera_setting['text']}")
\ No newline at end of file
+        if not frames:
+            os.replace(partial_path, video_path)
+        print(f"Saved to {video_dir} for {video_name_per_flag[render_target]} {camera_setting['text']}")
@@ -1,9 +1,13 @@
 import argparse
+import json
 import os
 import subprocess
+import tempfile
 from pathlib import Path
 
 from visualize.process_pkl import process_pkl_file
+from visualize.device import resolve_device, configure_cpu_threads
+from visualize.video import encode_frame_dirs
 from visualize.const import *
 
 OUTPUT_DIR_PATH = Path(OUTPUT_DIR)
@@ -11,15 +15,46 @@ CACHE_DIR_PATH = Path(CACHE_DIR)
 RESULT_DIR_PATH = Path(VIDEO_DIR)
 RENDER_SMPL_SCRIPT = "blender/render_smpl.py"
 RENDER_PRIM_SCRIPT = "blender/render_prim.py"
+RENDER_BATCH_SCRIPT = "blender/render_batch.py"
+RENDER_JOBS_FILE_NAME = "render_jobs.json"
 
-def render_sequence(script: str, target_flag: int, output_name: str, video_dir: str, camera_no: int, scene_no: int, soft: bool, high: bool) -> None:
-    """Render a sequence using Blender."""
+def run_blender(script: str, script_args: list, num_shards: int = RENDER_SHARDS) -> None:
+    """Run a Blender script headless, split over num_shards parallel processes."""
     cmd = [
         "blender",
         BLENDER_PATH,  # Use constant from visualize.const
         "--background",
         "--python", script,
         "--",
+    ] + script_args
+    
+    env = os.environ.copy()
+    env["PYTHONPATH"] = os.getcwd()
+    if num_shards <= 1:
+        subprocess.run(cmd, check=True, env=env)
+        return
+    
+    # each shard renders a contiguous frame range to pngs, encoded into one video once all finish,
+    # with its share of the cores so the shards don't oversubscribe the machine
+    num_threads = max(1, (os.cpu_count() or 1) // num_shards)
+    shard_cmd = cmd[:3] + ["--threads", str(num_threads)] + cmd[3:]
+    processes = [subprocess.Popen(shard_cmd + ["--shard", str(shard), "--num_shards", str(num_shards)], env=env)
+                 for shard in range(num_shards)]
+    try:
+        for shard, process in enumerate(processes):
+            if process.wait() != 0:
+                raise subprocess.CalledProcessError(process.returncode, f"blender shard {shard}")
+    finally:
+        # don't leave the other shards writing frames after a failure or an interrupt
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+                process.wait()
+
+def render_sequence(script: str, target_flag: int, output_name: str, video_dir: str, camera_no: int, scene_no: int, soft: bool, high: bool, single_mesh: bool = False,
+                    num_shards: int = RENDER_SHARDS, frames: bool = RENDER_FRAMES) -> None:
+    """Render a sequence using Blender."""
+    script_args = [
         "-i", str(OUTPUT_DIR_PATH / output_name),
         "-o", str(video_dir),
         "-t", str(target_flag),
@@ -28,13 +63,57 @@ def render_sequence(script: str, target_flag: int, output_name: str, video_dir:
     ]
     
     if soft:
-        cmd.append("-s")
+        script_args.append("-s")
     if high:
-        cmd.append("-q")
+        script_args.append("-q")
+    if single_mesh:
+        script_args.append("-sm")
+    if frames:
+        script_args.append("--frames")
+    
+    run_blender(script, script_args, num_shards)
+    if frames or num_shards > 1:
+        encode_frame_dirs(video_dir, video_name_per_flag[target_flag])
+
+def render_batch(jobs: list, video_dir: str, camera_no: int, scene_no: int, high: bool, single_mesh: bool = False,
+                 num_shards: int = RENDER_SHARDS, frames: bool = RENDER_FRAMES) -> None:
+    """Render (target_flag, output_name, soft) jobs in one Blender session, loading the scene once."""
+    job_list = [{
+        "input": str(OUTPUT_DIR_PATH / output_name),
+        "output": str(video_dir),
+        "target": target_flag,
+        "soft": soft,
+        "camera": camera_no,
+    } for target_flag, output_name, soft in jobs]
+    
+    os.makedirs(video_dir, exist_ok=True)
+    # the job list only lives as long as the Blender run, keep it out of the output directory
+    with tempfile.TemporaryDirectory() as jobs_dir:
+        jobs_path = os.path.join(jobs_dir, RENDER_JOBS_FILE_NAME)
+        with open(jobs_path, 'w') as f:
+            json.dump(job_list, f, indent=2)
         
-    env = os.environ.copy()
-    env["PYTHONPATH"] = os.getcwd()
-    subprocess.run(cmd, check=True, env=env)
+        script_args = ["-j", jobs_path, "-sc", str(scene_no)]
+        if high:
+            script_args.append("-q")
+        if single_mesh:
+            script_args.append("-sm")
+        if frames:
+            script_args.append("--frames")
+        
+        run_blender(RENDER_BATCH_SCRIPT, script_args, num_shards)
+    if frames or num_shards > 1:
+        for target_flag in dict.fromkeys(job["target"] for job in job_list):
+            encode_frame_dirs(video_dir, video_name_per_flag[target_flag])
+
+def render_jobs(script: str, jobs: list, video_dir: str, camera_no: int, scene_no: int, high: bool, single_mesh: bool = False,
+                num_shards: int = RENDER_SHARDS, frames: bool = RENDER_FRAMES) -> None:
+    """Render SMPL jobs in one batch session, primitive jobs one Blender process each."""
+    if script == RENDER_SMPL_SCRIPT:
+        render_batch(jobs, video_dir, camera_no, scene_no, high, single_mesh, num_shards, frames)
+        return
+    for target_flag, output_name, soft in jobs:
+        render_sequence(script, target_flag, output_name, video_dir, camera_no, scene_no, soft, high, single_mesh, num_shards, frames)
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Build and render SMPL meshes")
@@ -47,6 +126,22 @@ def main() -> None:
     parser.add_argument('-s', '--soft', action='store_true', help='Use soft material')
     parser.add_argument('-q', '--high', action='store_true', help='Use high quality rendering settings')
     parser.add_argument('-p', '--prim', action='store_true', help='Use primitive rendering')
+    parser.add_argument('-sm', '--single_mesh', action='store_true', help='Animate one mesh per body instead of importing one object per frame')
+    parser.add_argument('-f', '--format', type=str, choices=[EXPORT_FORMAT_NPY, EXPORT_FORMAT_OBJ], help=f'Mesh export format, default={EXPORT_FORMAT}', default=EXPORT_FORMAT)
+    parser.add_argument('--workers', type=int, help='Obj export workers, default=all cores, 1 to export serially', default=EXPORT_WORKERS)
+    parser.add_argument('--pool', type=str, choices=[EXPORT_POOL_PROCESS, EXPORT_POOL_THREAD], help=f'Obj export pool type, default={EXPORT_POOL}', default=EXPORT_POOL)
+    parser.add_argument('--interp', type=str, choices=[INTERPOLATE_MODE_POSE, INTERPOLATE_MODE_VERTEX], help=f'Frame upsampling in pose (slerp) or vertex (lerp) space, default={INTERPOLATE_MODE}', default=INTERPOLATE_MODE)
+    parser.add_argument('--lazy', action='store_true', help='Compute SMPL vertices per exported chunk instead of keeping whole sequences in memory')
+    parser.add_argument('--shards', type=int, help=f'Parallel Blender processes per render, each rendering a frame range, default={RENDER_SHARDS}', default=RENDER_SHARDS)
+    parser.add_argument('--frames', action='store_true', help='Render resumable png frames and encode the videos afterwards')
+    parser.add_argument('-d', '--device', type=str, help='SMPLify device: auto, cpu, cuda or cuda:<idx>', default='auto')
+    parser.add_argument('-j', '--threads', type=int, help='CPU threads for SMPLify, default=all cores', default=None)
+    parser.add_argument('-w', '--window', type=int, help='Fit SMPLify in warm-started windows of this many frames', default=SMPLIFY_WINDOW_SIZE)
+    parser.add_argument('--iters', type=int, help=f'Max SMPLify body fitting steps, default={SMPLIFY_ITERS}', default=SMPLIFY_ITERS)
+    parser.add_argument('--cam_iters', type=int, help=f'Max SMPLify camera fitting steps, default={SMPLIFY_CAM_ITERS}', default=SMPLIFY_CAM_ITERS)
+    parser.add_argument('--inner_iters', type=int, help=f'LBFGS iterations per SMPLify body fitting step, default={SMPLIFY_MAX_INNER_ITERS}', default=SMPLIFY_MAX_INNER_ITERS)
+    parser.add_argument('--tol', type=float, help=f'Relative loss change to stop SMPLify early, 0 to disable, default={SMPLIFY_FTOL}', default=SMPLIFY_FTOL)
+    parser.add_argument('--compile', action='store_true', help='Compile the SMPLify body loss with torch.compile')
     
     args = parser.parse_args()
     input_path = args.input
@@ -58,6 +153,25 @@ def main() -> None:
     soft = args.soft
     high = args.high
     prim = args.prim
+    single_mesh = args.single_mesh
+    num_shards = args.shards
+    frames = args.frames or RENDER_FRAMES
+    process_options = {'export_format': args.format, 'export_workers': args.workers, 'export_pool': args.pool,
+                       'interpolate_mode': args.interp, 'lazy': args.lazy or CONVERTER_LAZY}
+    
+    device = resolve_device(args.device)
+    if device.type == 'cpu':
+        num_threads = configure_cpu_threads(args.threads)
+        print(f"Running SMPLify on CPU with {num_threads} threads")
+    smplify_options = {
+        'window_size': args.window,
+        'num_iters': args.iters,
+        'num_cam_iters': args.cam_iters,
+        'max_inner_iters': args.inner_iters,
+        'ftol': args.tol,
+        'gtol': SMPLIFY_GTOL if args.tol > 0 else 0.0,
+        'compile': args.compile or SMPLIFY_COMPILE,
+    }
     
     # Create necessary directories
     OUTPUT_DIR_PATH.mkdir(exist_ok=True)
@@ -71,9 +185,7 @@ def main() -> None:
     input_path = Path(input_path)
     video_dir = os.path.join(RESULT_DIR_PATH, ('smpl_' if not prim else 'prim_') + input_path.stem)
     
-    # if os.path.exists(video_dir):
-    #     print(f"Video directory already exists: {video_dir}")
-    #     return
+    # videos that already exist are skipped per camera by the render scripts
     
     script = RENDER_SMPL_SCRIPT if not prim else RENDER_PRIM_SCRIPT
     
@@ -86,15 +198,23 @@ def main() -> None:
             return
         
         if gt:
-            process_pkl_file(str(input_path), keys_to_process_per_flag['gt'], prim)
-            render_sequence(script, TARGET_FLAG_GT, input_path.stem, video_dir, camera_no, scene_no, soft, high)
-            render_sequence(script, TARGET_FLAG_INPUT, input_path.stem, video_dir, camera_no, scene_no, soft, high)
-            render_sequence(script, TARGET_FLAG_REFINE, input_path.stem, video_dir, camera_no, scene_no, False, high)
+            process_pkl_file(str(input_path), keys_to_process_per_flag['gt'], prim, device=device, smplify_options=smplify_options,
+                             **process_options)
+            jobs = [
+                (TARGET_FLAG_GT, input_path.stem, soft),
+                (TARGET_FLAG_INPUT, input_path.stem, soft),
+                (TARGET_FLAG_REFINE, input_path.stem, False),
+            ]
+            render_jobs(script, jobs, video_dir, camera_no, scene_no, high, single_mesh, num_shards, frames)
         else:
-            process_pkl_file(str(input_path), keys_to_process_per_flag['default'], prim)
-            render_sequence(script, TARGET_FLAG_NONE, input_path.stem, video_dir, camera_no, scene_no, soft, high)
-            render_sequence(script, TARGET_FLAG_INPUT, input_path.stem, video_dir, camera_no, scene_no, soft, high)
-            render_sequence(script, TARGET_FLAG_REFINE, input_path.stem, video_dir, camera_no, scene_no, False, high)
+            process_pkl_file(str(input_path), keys_to_process_per_flag['default'], prim, device=device, smplify_options=smplify_options,
+                             **process_options)
+            jobs = [
+                (TARGET_FLAG_NONE, input_path.stem, soft),
+                (TARGET_FLAG_INPUT, input_path.stem, soft),
+                (TARGET_FLAG_REFINE, input_path.stem, False),
+            ]
+            render_jobs(script, jobs, video_dir, camera_no, scene_no, high, single_mesh, num_shards, frames)
             
     elif input_path.is_dir():
         if ablation:
@@ -116,17 +236,22 @@ def main() -> None:
             file_woig = pkl_files[3]
             file_wopose = pkl_files[4]
             
-            process_pkl_file(str(file_all), keys_to_process_per_flag['ab_all'], prim)
+            process_pkl_file(str(file_all), keys_to_process_per_flag['ab_all'], prim, device=device, smplify_options=smplify_options,
+                             **process_options)
             for file_wo in [file_wocontact, file_woprox, file_woig, file_wopose]:
-                process_pkl_file(str(file_wo), keys_to_process_per_flag['ab_wo'], prim)
+                process_pkl_file(str(file_wo), keys_to_process_per_flag['ab_wo'], prim, device=device, smplify_options=smplify_options,
+                                 **process_options)
             
-            render_sequence(script, TARGET_FLAG_GT, file_all.stem, video_dir, camera_no, scene_no, soft, high)
-            render_sequence(script, TARGET_FLAG_PSEUDO_GT, file_all.stem, video_dir, camera_no, scene_no, soft, high)
-            render_sequence(script, TARGET_FLAG_REFINE_PSEUDO_GT, file_all.stem, video_dir, camera_no, scene_no, False, high)
-            render_sequence(script, TARGET_FLAG_WOCONTACT, file_wocontact.stem, video_dir, camera_no, scene_no, False, high)
-            render_sequence(script, TARGET_FLAG_WOPROX, file_woprox.stem, video_dir, camera_no, scene_no, False, high)
-            render_sequence(script, TARGET_FLAG_WOIG, file_woig.stem, video_dir, camera_no, scene_no, False, high)
-            render_sequence(script, TARGET_FLAG_WOPOSE, file_wopose.stem, video_dir, camera_no, scene_no, False, high)
+            jobs = [
+                (TARGET_FLAG_GT, file_all.stem, soft),
+                (TARGET_FLAG_PSEUDO_GT, file_all.stem, soft),
+                (TARGET_FLAG_REFINE_PSEUDO_GT, file_all.stem, False),
+                (TARGET_FLAG_WOCONTACT, file_wocontact.stem, False),
+                (TARGET_FLAG_WOPROX, file_woprox.stem, False),
+                (TARGET_FLAG_WOIG, file_woig.stem, False),
+                (TARGET_FLAG_WOPOSE, file_wopose.stem, False),
+            ]
+            render_jobs(script, jobs, video_dir, camera_no, scene_no, high, single_mesh, num_shards, frames)
             
         else:
             print("Error: Directory input is only available with ablation mode (-a/--ablation)")
@@ -0,0 +1,74 @@
+import argparse
+import pickle
+import time
+import numpy as np
+import torch
+
+from visualize.const import *
+from visualize.device import resolve_device, configure_cpu_threads
+from visualize.format_sequences import format_joint_sequences
+from visualize.jnt2rot_wrapper import fit_joint_sequences
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark SMPLify fitting on a pkl file")
+    parser.add_argument('-i', '--input', type=str, required=True, help='.pkl file with joint sequences')
+    parser.add_argument('-k', '--key', type=str, default=KEY_INPUT_P1_JNTS, help='Joint sequence key to fit')
+    parser.add_argument('-n', '--num_frames', type=int, default=None, help='Only fit the first n frames')
+    parser.add_argument('-d', '--device', type=str, default='auto', help='auto, cpu, cuda or cuda:<idx>')
+    parser.add_argument('-j', '--threads', type=int, default=None, help='CPU threads, default=all cores')
+    parser.add_argument('-w', '--window', type=int, default=SMPLIFY_WINDOW_SIZE, help='Warm-started window size')
+    parser.add_argument('--iters', type=int, default=SMPLIFY_ITERS, help='Max body fitting steps')
+    parser.add_argument('--inner_iters', type=int, default=SMPLIFY_MAX_INNER_ITERS, help='LBFGS iterations per body fitting step')
+    parser.add_argument('--tol', type=float, default=SMPLIFY_FTOL, help='Relative loss change to stop early')
+    parser.add_argument('--compile', action='store_true', help='Compile the SMPLify body loss with torch.compile')
+    parser.add_argument('-r', '--repeat', type=int, default=1, help='Number of timed runs')
+    return parser.parse_args()
+
+def load_joints(data_file, key, num_frames=None):
+    with open(data_file, 'rb') as f:
+        data = pickle.load(f, encoding='latin1')
+    joints = data[key]
+    if torch.is_tensor(joints):
+        joints = joints.numpy()
+    if num_frames is not None:
+        joints = joints[:num_frames]
+    return format_joint_sequences(joints)['motion'][0].transpose(2, 0, 1)  # [nframes, njoints, 3]
+
+def synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+def benchmark_smplify(joints, device, repeat, smplify_options):
+    num_frames = joints.shape[0]
+
+    times = []
+    for run in range(repeat):
+        synchronize(device)
+        start = time.perf_counter()
+        fit_joint_sequences(joints[None], device=device, **smplify_options)
+        synchronize(device)
+        times.append(time.perf_counter() - start)
+        print(f"Run {run}: {times[-1]:.2f}s ({num_frames / times[-1]:.2f} frames/s)")
+
+    return np.median(times)
+
+def main():
+    args = parse_args()
+    device = resolve_device(args.device)
+    if device.type == 'cpu':
+        num_threads = configure_cpu_threads(args.threads)
+        print(f"Device: cpu, {num_threads} threads")
+    else:
+        print(f"Device: {torch.cuda.get_device_name(device)}")
+
+    joints = load_joints(args.input, args.key, args.num_frames)
+    print(f"Fitting {joints.shape[0]} frames of '{args.key}' from {args.input}")
+    smplify_options = {'window_size': args.window, 'num_iters': args.iters,
+                       'max_inner_iters': args.inner_iters, 'ftol': args.tol,
+                       'gtol': SMPLIFY_GTOL if args.tol > 0 else 0.0,  # same pair as main.py
+                       'compile': args.compile or SMPLIFY_COMPILE}
+    median = benchmark_smplify(joints, device, args.repeat, smplify_options)
+    print(f"Median: {median:.2f}s ({joints.shape[0] / median:.2f} frames/s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import time
+import torch
+
+from visualize.device import resolve_device, configure_cpu_threads
+from visualize.model_registry import get_pose_prior
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the GMM pose prior against its per-call reference")
+    parser.add_argument('-d', '--device', type=str, default='auto', help='auto, cpu, cuda or cuda:<idx>')
+    parser.add_argument('-j', '--threads', type=int, default=None, help='CPU threads, default=all cores')
+    parser.add_argument('-b', '--batch_sizes', type=int, nargs='+', default=[1, 64, 512], help='Poses per call')
+    parser.add_argument('-n', '--calls', type=int, default=200, help='Forward and backward calls per timing')
+    parser.add_argument('-t', '--tol', type=float, default=1e-3, help='Max relative error against the float64 reference')
+    return parser.parse_args()
+
+def reference_merged_log_likelihood(prior, pose):
+    """Merged log-likelihood as computed before the precomputed factors, with the full precisions and a log per call"""
+    diff_from_mean = pose.unsqueeze(dim=1) - prior.means
+    prec_diff_prod = torch.einsum('mij,bmj->bmi', [prior.precisions, diff_from_mean])
+    diff_prec_quadratic = (prec_diff_prod * diff_from_mean).sum(dim=-1)
+    curr_loglikelihood = 0.5 * diff_prec_quadratic - torch.log(prior.nll_weights)
+    min_likelihood, _ = torch.min(curr_loglikelihood, dim=1)
+    return min_likelihood
+
+def reference_log_likelihood(prior, pose):
+    """Non-merged log-likelihood as computed before, one component and determinant at a time"""
+    likelihoods = []
+    for idx in range(prior.num_gaussians):
+        diff_from_mean = pose - prior.means[idx]
+        curr_loglikelihood = torch.einsum('bj,ji->bi', [diff_from_mean, prior.precisions[idx]])
+        curr_loglikelihood = torch.einsum('bi,bi->b', [curr_loglikelihood, diff_from_mean])
+        cov_term = torch.log(torch.det(prior.covs[idx]) + prior.epsilon)
+        curr_loglikelihood += 0.5 * (cov_term + prior.random_var_dim * prior.pi_term)
+        likelihoods.append(curr_loglikelihood)
+    log_likelihoods = torch.stack(likelihoods, dim=1)
+    min_likelihood, min_idx = torch.min(log_likelihoods, dim=1)
+    return -torch.log(prior.nll_weights[0, min_idx]) + min_likelihood
+
+def synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+def time_calls(fn, pose, num_calls, device):
+    """Seconds per forward and backward call"""
+    fn(pose).sum().backward()
+    synchronize(device)
+    start = time.perf_counter()
+    for _ in range(num_calls):
+        pose.grad = None
+        fn(pose).sum().backward()
+    synchronize(device)
+    return (time.perf_counter() - start) / num_calls
+
+def compare(name, fn, reference, pose, num_calls, device, tol):
+    """Times fn against the float32 reference and checks fn against the same reference in float64.
+
+    The float32 reference is what ran before and is only timed: the covariances are ill-conditioned, so its
+    inverses and determinants are too far off to check against.
+    """
+    with torch.no_grad():
+        value = fn(pose).double()
+        expected = reference(pose.double(), torch.float64)
+    error = ((value - expected).abs() / expected.abs().clamp(min=1)).max().item()
+    assert error <= tol, f"{name} batch {len(pose)}: max relative error {error:.2e} above {tol:.0e}"
+    fused = time_calls(fn, pose, num_calls, device)
+    original = time_calls(lambda p: reference(p, torch.float32), pose, num_calls, device)
+    print(f"{name:>8} batch {len(pose):>5}: {original * 1e3:.3f}ms -> {fused * 1e3:.3f}ms "
+          f"({original / fused:.1f}x), max relative error {error:.2e}")
+
+def main():
+    args = parse_args()
+    device = resolve_device(args.device)
+    if device.type == 'cpu':
+        num_threads = configure_cpu_threads(args.threads)
+        print(f"Device: cpu, {num_threads} threads")
+    else:
+        print(f"Device: {torch.cuda.get_device_name(device)}")
+
+    prior = get_pose_prior(device)
+    priors = {torch.float32: prior, torch.float64: get_pose_prior(device, dtype=torch.float64)}
+    generator = torch.Generator().manual_seed(0)
+    for batch_size in args.batch_sizes:
+        # poses around the mixture, like the ones SMPLify visits
+        noise = 0.3 * torch.randn(batch_size, prior.random_var_dim, generator=generator)
+        pose = (prior.get_mean().cpu() + noise).to(device).requires_grad_(True)
+        compare('merged', lambda p: prior.merged_log_likelihood(p, None),
+                lambda p, dtype: reference_merged_log_likelihood(priors[dtype], p), pose, args.calls, device, args.tol)
+        compare('full', lambda p: prior.log_likelihood(p, None),
+                lambda p, dtype: reference_log_likelihood(priors[dtype], p), pose, args.calls, device, args.tol)
+
+if __name__ == "__main__":
+    main()
@@ -38,7 +38,8 @@ OBJ_OBJ_ORIGINAL = 'original_obj'
 OBJ_OBJ_FILTERED = 'filtered_obj'
 
 CACHE_DIR = 'cache'
-CACHE_SUFFIX = '_converters.pkl'
+CACHE_SUFFIX = '.npz'
+CACHE_MAX_BYTES = 2 * 1024 ** 3 # least recently used fits are evicted past this size
 
 INFO_ROOT_LOC_P1 = 'root_loc1'
 INFO_ROOT_LOC_P2 = 'root_loc2'
@@ -48,9 +49,65 @@ INFO_CAM = 'cam'
 
 PRIM_FILE_NAME = 'prim.npz'
 
+# per-key vertex sequence, float32 [frames, V, 3] in obj coordinates, faces stored once
+SEQUENCE_FILE_NAME = 'vertices.npy'
+FACES_FILE_NAME = 'faces.npy'
+# objects that only move rigidly are stored as a rest mesh and a [frames, 4, 4] transform track
+RIGID_COMPRESS = True
+RIGID_TOLERANCE = 1e-3 # largest vertex error (m) of the rigid fit, above it the vertex sequence is kept
+RIGID_REST_FILE_NAME = 'rest.npy'
+RIGID_TRANSFORMS_FILE_NAME = 'transforms.npy'
+RIGID_REST_SUFFIX = '_rest' # prim.npz keys of rigid objects
+RIGID_TRANSFORMS_SUFFIX = '_transforms'
+EXPORT_FORMAT_OBJ = 'obj'
+EXPORT_FORMAT_NPY = 'npy'
+EXPORT_FORMAT = EXPORT_FORMAT_NPY
+
+# parallel obj export, process workers read vertices from shared memory
+EXPORT_POOL_PROCESS = 'process'
+EXPORT_POOL_THREAD = 'thread'
+EXPORT_POOL = EXPORT_POOL_PROCESS
+EXPORT_WORKERS = None # None for all cores, 1 to export in the main process
+EXPORT_CHUNK_SIZE = 32 # frames per export task
+VERTEX_CHUNK_SIZE = 256 # frames interpolated and moved to the host at once
+
 INTERPOLATE = 2.0
+# pose: slerp joint rotations and lerp the root before the SMPL forward pass
+# vertex: lerp mesh vertices of neighbouring frames
+INTERPOLATE_MODE_POSE = 'pose'
+INTERPOLATE_MODE_VERTEX = 'vertex'
+INTERPOLATE_MODE = INTERPOLATE_MODE_POSE
+
+SMPL_CHUNK_SIZE = 512 # frames per SMPL forward pass, None for the whole sequence at once
+CONVERTER_LAZY = False # compute vertices per requested frame range instead of keeping all frames
+
+SMPLIFY_BATCHED = True # fit all joint sequences of a file in one optimization
+SMPLIFY_WINDOW_SIZE = None # frames per warm-started window, None fits whole sequences at once
+SMPLIFY_WINDOW_OVERLAP = 8
+SMPLIFY_WARM_ITERS = 30
+SMPLIFY_ITERS = 150 # outer LBFGS steps of the body stage
+SMPLIFY_CAM_ITERS = 10 # outer LBFGS steps of the camera stage
+SMPLIFY_MAX_INNER_ITERS = 20 # LBFGS iterations per outer step of the body stage
+SMPLIFY_CAM_INNER_ITERS = 20 # LBFGS iterations per outer step of the camera stage
+SMPLIFY_FTOL = 1e-6 # stop once the relative loss change per step drops below this
+SMPLIFY_GTOL = 1e-5 # stop once the largest gradient entry drops below this
+SMPLIFY_COMPILE = False # torch.compile the SMPL forward plus body loss of the LBFGS closure
+
+SMOOTH_JERK_THRESHOLD = 1.0 # joint angular acceleration (rad/frame^2) marking a jerk
+SMOOTH_EXPAND_FRAMES = 1 # jerks separated by at most this many calm frames share an interval
 
 VIDEO_DIR = "video"
+VIDEO_FPS = 30
+VIDEO_EXT = '.mp4'
+# sharded renders write <video name>_frames/frame_0001.png ... and are encoded afterwards
+FRAMES_DIR_SUFFIX = '_frames'
+FRAME_FILE_PREFIX = 'frame_'
+FRAME_FILE_EXT = '.png'
+RENDER_SHARDS = 1 # parallel Blender processes per render, each rendering a contiguous frame range
+RENDER_FRAMES = False # render pngs that survive interruptions and encode them afterwards
+RENDER_KEEP_FRAMES = False # keep the png frames of a video once it is encoded
+PARTIAL_SUFFIX = '_partial' # videos are written under this name until complete
+PRIM_INSTANCED = True # joints and bones are linked duplicates of one template sphere and cylinder mesh
 BLENDER_PATH = "blender/scene.blend"
 
 TARGET_FLAG_NONE = 0
@@ -92,6 +149,16 @@ keys_to_render_per_flag = { # object should come first
   TARGET_FLAG_WOCONTACT: [KEY_FILTERED_OBJ_VERTS, KEY_REFINE_PSEUDO_GT_P1_JNTS, KEY_REFINE_PSEUDO_GT_P2_JNTS],
 }
 
+camera_params = [
+    # azimuth, text
+    [0,      "cam00"],
+    [20,     "cam01"],
+    [-20,    "cam02"],
+    [180,    "cam03"],
+    [200,    "cam04"],
+    [160,    "cam05"],
+]
+
 video_name_per_flag = {
     TARGET_FLAG_NONE: "obj_only",
     TARGET_FLAG_INPUT: "input", 
@@ -1,10 +1,70 @@
 import numpy as np
-from trimesh import Trimesh
 
 from abc import ABC, abstractmethod
+from visualize.export import format_obj_faces, write_obj
+from visualize.const import VERTEX_CHUNK_SIZE
+
+def get_interpolation_indices(start, end, interpolate, original_num_frames):
+    """Source frames and lerp weights of output frames [start, end), past the last frame holds it.
+
+    Returns:
+        idx0, idx1: int64 arrays of shape [end-start]
+        alpha: float64 array of shape [end-start]
+    """
+    frame_pos = np.arange(start, end) / interpolate
+    idx0 = frame_pos.astype(np.int64)
+    last = idx0 >= original_num_frames - 1
+    alpha = np.where(last, 0.0, frame_pos - idx0)
+    idx0 = np.minimum(idx0, original_num_frames - 1)
+    idx1 = np.minimum(idx0 + 1, original_num_frames - 1)
+    return idx0, idx1, alpha
 
 class converter(ABC):
     @abstractmethod
+    def get_vertex_array(self, frame_idx):
+        """Get a single frame's vertices as a float32 array of shape [V, 3].
+        
+        Args:
+            frame_idx: int, index of frame to get
+        """
+        pass
+    
+    @abstractmethod
+    def get_vertex_range(self, start, end):
+        """Get frames [start, end) in one vectorized gather and lerp, as a float32 array of shape [end-start, V, 3].
+        
+        Args:
+            start: int, first frame
+            end: int, frame after the last one
+        """
+        pass
+    
+    def get_all_vertices(self):
+        """Get every frame as a float32 array of shape [num_frames, V, 3]."""
+        return self.get_vertex_range(0, self.num_frames)
+    
+    def iter_vertex_chunks(self, chunk_size=VERTEX_CHUNK_SIZE, num_frames=None):
+        """Yield (start, vertices [<=chunk_size, V, 3]) so memory stays bounded by the chunk size.
+        
+        Args:
+            chunk_size: int, frames per chunk
+            num_frames: int, number of frames to yield, defaults to all
+        """
+        num_frames = self.num_frames if num_frames is None else num_frames
+        for start in range(0, num_frames, chunk_size):
+            yield start, self.get_vertex_range(start, min(start + chunk_size, num_frames))
+    
+    @abstractmethod
+    def get_faces(self):
+        """Get the triangle faces shared by all frames as an int array of shape [F, 3]."""
+        pass
+    
+    def get_faces_block(self):
+        """Get the obj face lines, formatted once since the topology never changes."""
+        if getattr(self, '_faces_block', None) is None:
+            self._faces_block = format_obj_faces(self.get_faces())
+        return self._faces_block
+    
     def save_obj(self, save_path, frame_idx):
         """Save a single frame's vertices and faces as an obj file.
         
@@ -12,4 +72,4 @@ class converter(ABC):
             save_path: str, path to save the obj file
             frame_idx: int, index of frame to save
         """
-        pass
+        return write_obj(save_path, self.get_vertex_array(frame_idx), self.get_faces_block())
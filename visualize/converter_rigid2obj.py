@@ -0,0 +1,37 @@
+import numpy as np
+import torch
+import visualize.utils.rotation_conversions as geometry
+from visualize.converter import converter, get_interpolation_indices
+from visualize.rigid import apply_rigid_transforms
+
+class converter_rigid2obj(converter):
+    """Rigidly moving mesh stored as a rest mesh and one transform per frame"""
+    def __init__(self, rest_verts, transforms, faces_list, interpolate):
+        self.rest_verts = rest_verts
+        self.transforms = transforms
+        self.faces_list = faces_list
+        self.interpolate = interpolate
+        self.original_num_frames = transforms.shape[0]
+        self.num_frames = int(self.original_num_frames * interpolate)
+
+    def get_transform_range(self, start, end):
+        """Transforms [end-start, 4, 4] of frames [start, end), rotations slerped and translations lerped
+        so in-between frames stay rigid"""
+        idx0, idx1, alpha = get_interpolation_indices(start, end, self.interpolate, self.original_num_frames)
+        t1 = self.transforms[idx0]
+        t2 = self.transforms[idx1]
+        rotations = geometry.matrix_slerp(torch.from_numpy(t1[:, :3, :3]), torch.from_numpy(t2[:, :3, :3]),
+                                          torch.from_numpy(alpha))
+        transforms = np.tile(np.eye(4), (len(alpha), 1, 1))
+        transforms[:, :3, :3] = rotations.numpy()
+        transforms[:, :3, 3] = t1[:, :3, 3] + alpha[:, None] * (t2[:, :3, 3] - t1[:, :3, 3])
+        return transforms
+
+    def get_vertex_array(self, frame_idx):
+        return self.get_vertex_range(frame_idx, frame_idx + 1)[0]
+
+    def get_vertex_range(self, start, end):
+        return apply_rigid_transforms(self.rest_verts, self.get_transform_range(start, end)).astype(np.float32)
+
+    def get_faces(self):
+        return self.faces_list
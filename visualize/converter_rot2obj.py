@@ -1,16 +1,23 @@
 from trimesh import Trimesh
 import torch
 import math 
-from visualize.converter import converter
-from visualize.smooth import smooth_motion
+import numpy as np
+from visualize.converter import converter, get_interpolation_indices
+from visualize.smooth import smooth_motion, upsample_motion
 from visualize.rotation2xyz import Rotation2xyz
+from visualize.device import resolve_device
+from visualize.const import INTERPOLATE_MODE, INTERPOLATE_MODE_POSE, SMPL_CHUNK_SIZE, CONVERTER_LAZY, VERTEX_CHUNK_SIZE
 import visualize.utils.rotation_conversions as geometry
 
 class converter_rot2obj(converter):
-    def __init__(self, motion_tensor, interpolate=1.0, device=0, cuda=True):
+    def __init__(self, motion_tensor, interpolate=1.0, device=None, interpolate_mode=INTERPOLATE_MODE,
+                 chunk_size=SMPL_CHUNK_SIZE, lazy=CONVERTER_LAZY):
         # Initialize rotation to xyz converter
-        rot2xyz = Rotation2xyz(device=motion_tensor.device)
-        self.faces = rot2xyz.smpl_model.faces
+        device = resolve_device(device)
+        motion_tensor = motion_tensor.to(device)
+        self.rot2xyz = Rotation2xyz(device=device)
+        self.faces = self.rot2xyz.smpl_model.faces
+        self.chunk_size = chunk_size
         
         self.original_num_frames = motion_tensor.shape[-1]
         motion_tensor = self.postprocess_neck(motion_tensor)
@@ -18,11 +25,30 @@ class converter_rot2obj(converter):
         self.interpolate = interpolate
         self.num_frames = int(self.original_num_frames * interpolate)
         
-        self.vertices = rot2xyz(motion_tensor, mask=None,
+        # frames held in self.vertices and the factor still applied to them by vertex lerp
+        self.vertex_num_frames = self.original_num_frames
+        self.vertex_interpolate = interpolate
+        if interpolate_mode == INTERPOLATE_MODE_POSE and interpolate != 1.0:
+            motion_tensor = upsample_motion(motion_tensor, interpolate)
+            self.vertex_num_frames = self.num_frames
+            self.vertex_interpolate = 1.0
+        
+        # lazy converters keep only the motion and run SMPL on the frames each request needs
+        self.motion_tensor = motion_tensor
+        self.vertices = None
+        if not lazy:
+            self.vertices = self.compute_vertices(0, self.vertex_num_frames)
+    
+    def compute_vertices(self, start, end):
+        """Vertices of frames [start, end) of the (upsampled) motion, [1, V, 3, end-start]"""
+        if self.vertices is not None:
+            return self.vertices[..., start:end]
+        with torch.no_grad():
+            return self.rot2xyz(self.motion_tensor[..., start:end], mask=None,
                                 pose_rep='rotmat', translation=True, glob=True,
                                 jointstype='vertices',
                                 # jointstype='smpl',  # for joint locations
-                                vertstrans=True)
+                                vertstrans=True, chunk_size=self.chunk_size)
                                      
     def postprocess_neck(self, motion_tensor):
         rotations = motion_tensor[:,:-1] # shape [1, 24, 9, 104] (matrix)
@@ -43,36 +69,53 @@ class converter_rot2obj(converter):
         return motion_tensor
     
     def get_vertices(self, sample_i, frame_i):
-        if self.interpolate == 1.0:
-            return self.vertices[sample_i, :, :, frame_i].squeeze().tolist()
+        if self.vertex_interpolate == 1.0:
+            return self.compute_vertices(frame_i, frame_i + 1)[sample_i, :, :, 0]
         else:
             # Get interpolated frame index
-            frame_pos = frame_i / self.interpolate
+            frame_pos = frame_i / self.vertex_interpolate
             frame_idx = int(frame_pos)
             alpha = frame_pos - frame_idx
             
-            if frame_idx >= self.original_num_frames - 1:
+            if frame_idx >= self.vertex_num_frames - 1:
                 # Handle last frame
-                return self.vertices[sample_i, :, :, -1].squeeze().tolist()
+                return self.compute_vertices(self.vertex_num_frames - 1, self.vertex_num_frames)[sample_i, :, :, 0]
             else:
-                v1 = self.vertices[sample_i, :, :, frame_idx]
-                v2 = self.vertices[sample_i, :, :, frame_idx + 1]
+                vertices = self.compute_vertices(frame_idx, frame_idx + 2)
+                v1 = vertices[sample_i, :, :, 0]
+                v2 = vertices[sample_i, :, :, 1]
                 interp = v1 + alpha * (v2 - v1)
-                return interp.squeeze().tolist()
+                return interp
+
+    def get_vertex_array(self, frame_i):
+        return self.get_vertices(0, frame_i).detach().cpu().numpy().astype(np.float32)
+
+    def get_vertex_range(self, start, end):
+        idx0, idx1, alpha = get_interpolation_indices(start, end, self.vertex_interpolate, self.vertex_num_frames)
+        if len(idx0) == 0:
+            return np.zeros((0, self.rot2xyz.smpl_model.v_template.shape[0], 3), dtype=np.float32)
+        # only the source frames this range touches, released once the range is returned
+        first = int(idx0.min())
+        vertices = self.compute_vertices(first, int(idx1.max()) + 1)[0].permute(2, 0, 1) # [n, V, 3]
+        v1 = vertices[torch.from_numpy(idx0 - first).to(vertices.device)]
+        if self.vertex_interpolate != 1.0:
+            v2 = vertices[torch.from_numpy(idx1 - first).to(vertices.device)]
+            alpha = torch.from_numpy(alpha).to(vertices)[:, None, None]
+            v1 = v1 + alpha * (v2 - v1)
+        # one host transfer for the whole range
+        return v1.detach().cpu().numpy().astype(np.float32)
+
+    def get_faces(self):
+        return self.faces
 
     def get_trimesh(self, sample_i, frame_i):
-        return Trimesh(vertices=self.get_vertices(sample_i, frame_i), faces=self.faces)
+        return Trimesh(vertices=self.get_vertices(sample_i, frame_i).detach().cpu().numpy(), faces=self.faces)
     
     def get_traj(self):
-        root_positions = self.vertices.cpu().numpy().mean(axis=(0, 1))  # [3, frame_n]
-        root_positions = root_positions.transpose(1, 0)  # [frame_n, 3]
+        root_positions = torch.cat([self.compute_vertices(start, start + VERTEX_CHUNK_SIZE).mean(dim=(0, 1))
+                                    for start in range(0, self.vertex_num_frames, VERTEX_CHUNK_SIZE)], dim=-1)  # [3, frame_n]
+        root_positions = root_positions.cpu().numpy().transpose(1, 0)  # [frame_n, 3]
         return root_positions
-
-    def save_obj(self, save_path, frame_i):
-        mesh = self.get_trimesh(0, frame_i)
-        with open(save_path, 'w') as fw:
-            mesh.export(fw, 'obj')
-        return save_path     
     
     def format_motion(self, motion_tensor, cam):
         # Reshape motion tensor with permute to maintain correct order
@@ -1,6 +1,5 @@
-from trimesh import Trimesh
 import numpy as np
-from visualize.converter import converter
+from visualize.converter import converter, get_interpolation_indices
 
 class converter_vf2obj(converter):
     def __init__(self, verts_list, faces_list, interpolate):
@@ -24,15 +23,15 @@ class converter_vf2obj(converter):
             v2 = self.verts_list[orig_frame_idx + 1]
             return v1 + alpha * (v2 - v1)
 
-    def save_obj(self, save_path, frame_idx):
-        # Get interpolated vertices for this frame
-        vertices = self.get_interpolated_vertices(frame_idx)
-        
-        # Create trimesh object
-        mesh = Trimesh(vertices=vertices, faces=self.faces_list)
+    def get_vertex_array(self, frame_idx):
+        return np.asarray(self.get_interpolated_vertices(frame_idx), dtype=np.float32)
 
-        # Export to obj file
-        with open(save_path, 'w') as f:
-            mesh.export(f, 'obj')
+    def get_vertex_range(self, start, end):
+        idx0, idx1, alpha = get_interpolation_indices(start, end, self.interpolate, self.original_num_frames)
+        v1 = self.verts_list[idx0]
+        v2 = self.verts_list[idx1]
+        alpha = alpha[:, None, None]
+        return (v1 + alpha * (v2 - v1)).astype(np.float32)
 
-        return save_path
\ No newline at end of file
+    def get_faces(self):
+        return self.faces_list
\ No newline at end of file
@@ -0,0 +1,47 @@
+import os
+import torch
+
+
+def resolve_device(device=None):
+    """Resolve a device spec to a torch.device, falling back to CPU without CUDA.
+
+    Args:
+        device: None or 'auto' for the best available device, 'cpu', 'cuda',
+                'cuda:<idx>', a CUDA index or a torch.device
+    """
+    if isinstance(device, torch.device):
+        resolved = device
+    elif device is None or device == 'auto':
+        resolved = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+    elif isinstance(device, int) or str(device).isdigit():
+        resolved = torch.device(f'cuda:{int(device)}')
+    else:
+        resolved = torch.device(device)
+
+    if resolved.type == 'cuda' and not torch.cuda.is_available():
+        print(f"Warning: CUDA is not available, running on CPU instead of {resolved}")
+        resolved = torch.device('cpu')
+    return resolved
+
+
+def configure_cpu_threads(num_threads=None):
+    """Set the intra-op and inter-op thread counts used by torch on CPU.
+
+    SMPLify is the only torch work and runs alone in the main process, before the
+    export pool and the Blender renders start, so it may use every core.
+
+    Args:
+        num_threads: intra-op threads, defaults to all cores
+    Returns:
+        The number of intra-op threads in use
+    """
+    if num_threads is None:
+        num_threads = os.cpu_count() or 1
+    torch.set_num_threads(num_threads)
+    try:
+        # SMPLify has little inter-op parallelism, keep this pool small
+        torch.set_num_interop_threads(min(num_threads, 4))
+    except RuntimeError:
+        # can only be set once, before any parallel work has started
+        pass
+    return torch.get_num_threads()
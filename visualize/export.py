@@ -0,0 +1,158 @@
+import os
+import time
+import math
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from visualize.const import *
+
+# this module is imported by spawned export workers, keep it free of torch
+
+# header comment trimesh writes, the layout follows its exports but the files are not byte-identical
+OBJ_HEADER = '# https://github.com/mikedh/trimesh\n'
+
+# vertex sequences attached by each worker process, {key: (shm, vertices, faces_block, out_dir)}
+_worker_sequences = {}
+
+
+def get_obj_path(out_dir, frame_i):
+    return os.path.join(out_dir, f"frame_{frame_i:04d}.obj")
+
+
+def format_obj_faces(faces):
+    """Format the 1-based 'f' lines of a fixed topology once, to reuse for every frame"""
+    faces = np.asarray(faces, dtype=np.int64) + 1
+    return ('f %d %d %d\n' * len(faces)) % tuple(faces.ravel().tolist())
+
+
+def write_obj(path, vertices, faces_block):
+    """Write one obj frame without building a mesh.
+
+    Args:
+        path: output obj path
+        vertices: array of shape [V, 3]
+        faces_block: face lines from format_obj_faces
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    with open(path, 'w') as fw:
+        fw.write(OBJ_HEADER)
+        fw.write(('v %.8f %.8f %.8f\n' * len(vertices)) % tuple(vertices.ravel().tolist()))
+        fw.write(faces_block)
+    return path
+
+
+def write_frames(sequences, key, frames):
+    """Write one obj per frame of a vertex sequence.
+
+    Args:
+        sequences: {key: (vertices [num_frames, V, 3], faces_block, out_dir)}
+        key: sequence to write
+        frames: frame indices to write
+    """
+    vertices, faces_block, out_dir = sequences[key]
+    for frame_i in frames:
+        write_obj(get_obj_path(out_dir, frame_i), vertices[frame_i], faces_block)
+    return len(frames)
+
+
+def _init_worker(shared_sequences):
+    """Attach to the shared vertex blocks once per worker process"""
+    for key, (name, shape, faces_block, out_dir) in shared_sequences.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _worker_sequences[key] = (shm, np.ndarray(shape, dtype=np.float32, buffer=shm.buf), faces_block, out_dir)
+
+
+def _write_shared_frames(key, frames):
+    sequences = {k: (vertices, faces_block, out_dir) for k, (_, vertices, faces_block, out_dir) in _worker_sequences.items()}
+    return write_frames(sequences, key, frames)
+
+
+def get_missing_frames(out_dir, num_frames):
+    """Frames without an obj yet, from a single directory listing"""
+    existing = set(os.listdir(out_dir))
+    return [frame_i for frame_i in range(num_frames)
+            if os.path.basename(get_obj_path(out_dir, frame_i)) not in existing]
+
+
+def export_obj_sequences(sequences, num_workers=EXPORT_WORKERS, pool=EXPORT_POOL, chunk_size=EXPORT_CHUNK_SIZE):
+    """Write the missing per-frame objs of several vertex sequences in parallel.
+
+    Process workers read the vertices from shared memory instead of pickled copies.
+
+    Args:
+        sequences: {key: (converter, out_dir)}
+        num_workers: pool size, None for all cores, 1 to write in this process
+        pool: EXPORT_POOL_PROCESS or EXPORT_POOL_THREAD
+        chunk_size: frames per task
+    Returns:
+        number of obj files written
+    """
+    num_frames = min(converter.num_frames for converter, _ in sequences.values())
+    tasks = []
+    for key, (_, out_dir) in sequences.items():
+        missing = get_missing_frames(out_dir, num_frames)
+        tasks += [(key, missing[i:i + chunk_size]) for i in range(0, len(missing), chunk_size)]
+    total = sum(len(frames) for _, frames in tasks)
+    if total == 0:
+        return 0
+
+    num_workers = num_workers or os.cpu_count() or 1
+    num_workers = max(1, min(num_workers, len(tasks)))
+    start = time.perf_counter()
+
+    blocks = {}
+    arrays = {}
+    vertices = None
+    try:
+        for key, (converter, out_dir) in sequences.items():
+            shape = (num_frames,) + converter.get_vertex_array(0).shape
+            if num_workers > 1 and pool == EXPORT_POOL_PROCESS:
+                shm = shared_memory.SharedMemory(create=True, size=max(1, math.prod(shape) * 4))
+                blocks[key] = shm
+                vertices = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+            else:
+                vertices = np.empty(shape, dtype=np.float32)
+            for chunk_start, chunk in converter.iter_vertex_chunks(num_frames=num_frames):
+                vertices[chunk_start:chunk_start + len(chunk)] = chunk
+            arrays[key] = (vertices, converter.get_faces_block(), out_dir)
+
+        written = 0
+        def report(count):
+            progress = count / total * 100
+            print(f"\rSaving obj files: [{('=' * int(progress/2)).ljust(50)}] {progress:.1f}%", end='', flush=True)
+
+        if num_workers == 1:
+            for key, frames in tasks:
+                written += write_frames(arrays, key, frames)
+                report(written)
+        else:
+            if pool == EXPORT_POOL_PROCESS:
+                shared = {key: (blocks[key].name, vertices.shape, faces_block, out_dir)
+                          for key, (vertices, faces_block, out_dir) in arrays.items()}
+                # spawn, so workers never inherit a CUDA context from the fitting stage
+                executor = ProcessPoolExecutor(num_workers, mp_context=mp.get_context('spawn'),
+                                               initializer=_init_worker, initargs=(shared,))
+                submit = lambda key, frames: executor.submit(_write_shared_frames, key, frames)
+            else:
+                executor = ThreadPoolExecutor(num_workers)
+                submit = lambda key, frames: executor.submit(write_frames, arrays, key, frames)
+            with executor:
+                futures = [submit(key, frames) for key, frames in tasks]
+                for future in as_completed(futures):
+                    written += future.result()
+                    report(written)
+        print()
+    finally:
+        # drop the numpy views before releasing the shared blocks
+        arrays.clear()
+        vertices = None
+        for shm in blocks.values():
+            shm.close()
+            shm.unlink()
+
+    elapsed = time.perf_counter() - start
+    print(f"Saved {written} obj files with {num_workers} {pool} workers in {elapsed:.1f}s "
+          f"({written / elapsed:.1f} frames/s)")
+    return written
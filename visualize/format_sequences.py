@@ -9,20 +9,25 @@ def format_joint_sequences(*sequences):
                    where si is the sequence length for sequence i
     
     Returns:
-        Dictionary in the format expected by the visualization code
+        Dictionary in the format expected by the visualization code, with a
+        per-sequence 'mask' of shape (num_seqs, max_len) marking valid frames
     """
     num_seqs = len(sequences)
     seq_lengths = [seq.shape[0] for seq in sequences]
     
     max_len = max(seq_lengths)
     combined_seq = np.zeros((num_seqs, 24, 3, max_len))
+    mask = np.zeros((num_seqs, max_len), dtype=bool)
     
     for i, seq in enumerate(sequences):
         combined_seq[i, :, :, :seq_lengths[i]] = seq.transpose(1, 2, 0)[:, :, :seq_lengths[i]]
+        mask[i, :seq_lengths[i]] = True
     
     data_dict = {
         'motion': combined_seq,
         'num_samples': num_seqs,
+        'lengths': seq_lengths,
+        'mask': mask,
     }
     
     return data_dict
\ No newline at end of file
@@ -2,35 +2,34 @@ import torch
 import numpy as np
 import os
 import sys
-import smplx
-import h5py
 from tqdm import tqdm
 import argparse
 import visualize.utils.rotation_conversions as geometry
 from visualize.joints2smpl.src import config
 from visualize.joints2smpl.src.smplify import SMPLify3D
-from visualize.config import right_hand_pose, left_hand_pose
+from visualize.device import resolve_device
+from visualize.model_registry import get_smplx_model, get_mean_params
+from visualize.const import (SMPLIFY_ITERS, SMPLIFY_CAM_ITERS, SMPLIFY_MAX_INNER_ITERS, SMPLIFY_CAM_INNER_ITERS,
+                             SMPLIFY_FTOL, SMPLIFY_GTOL, SMPLIFY_COMPILE)
 
 class joints2smpl:
-    def __init__(self, num_frames, device_id, cuda=True):
-        self.device = torch.device("cuda:" + str(device_id) if cuda else "cpu")
-        # self.device = torch.device("cpu")
+    def __init__(self, num_frames, device=None, num_iters=SMPLIFY_ITERS, num_cam_iters=SMPLIFY_CAM_ITERS,
+                 max_inner_iters=SMPLIFY_MAX_INNER_ITERS, max_cam_inner_iters=SMPLIFY_CAM_INNER_ITERS,
+                 ftol=SMPLIFY_FTOL, gtol=SMPLIFY_GTOL, compile=SMPLIFY_COMPILE):
+        self.device = resolve_device(device)
         self.batch_size = num_frames
         self.num_joints = 22  # for HumanML3D
         self.joint_category = "AMASS"
-        self.num_smplify_iters = 150
+        self.num_smplify_iters = num_iters
         self.fix_foot = False
         
-        smplmodel = smplx.create(config.SMPL_MODEL_DIR,
-                                 model_type="smpl", gender="neutral", ext="pkl", flat_hand_mean=False, left_hand_pose=left_hand_pose, right_hand_pose=right_hand_pose,
-                                 batch_size=self.batch_size).to(self.device)
+        # shared per process, only the batch-sized parameters are built per batch size
+        smplmodel = get_smplx_model(self.batch_size, self.device)
 
         # ## --- load the mean pose as original ----
-        smpl_mean_file = config.SMPL_MEAN_FILE
-
-        file = h5py.File(smpl_mean_file, 'r')
-        self.init_mean_pose = torch.from_numpy(file['pose'][:]).unsqueeze(0).repeat(self.batch_size, 1).float().to(self.device)
-        self.init_mean_shape = torch.from_numpy(file['shape'][:]).unsqueeze(0).repeat(self.batch_size, 1).float().to(self.device)
+        mean_pose, mean_shape = get_mean_params(self.device)
+        self.init_mean_pose = mean_pose.repeat(self.batch_size, 1)
+        self.init_mean_shape = mean_shape.repeat(self.batch_size, 1)
         self.cam_trans_zero = torch.Tensor([0.0, 0.0, 0.0]).unsqueeze(0).to(self.device)
         #
 
@@ -39,9 +38,15 @@ class joints2smpl:
                             batch_size=self.batch_size,
                             joints_category=self.joint_category,
                             num_iters=self.num_smplify_iters,
-                            device=self.device)
+                            num_cam_iters=num_cam_iters,
+                            max_inner_iters=max_inner_iters,
+                            max_cam_inner_iters=max_cam_inner_iters,
+                            ftol=ftol,
+                            gtol=gtol,
+                            device=self.device,
+                            compile=compile)
 
-    def joint2smpl(self, input_joints, init_params=None):
+    def joint2smpl(self, input_joints, init_params=None, frame_mask=None, num_iters=None):
         _smplify = self.smplify # if init_params is None else self.smplify_fast
         pred_pose = torch.zeros(self.batch_size, 72).to(self.device)
         pred_betas = torch.zeros(self.batch_size, 10).to(self.device)  # Always initialize with zeros
@@ -80,15 +85,22 @@ class joints2smpl:
         else:
             print("Such category not settle down!")
 
+        if frame_mask is not None:
+            # padded frames carry no joint evidence, only the priors act on them
+            frame_mask = torch.as_tensor(frame_mask, dtype=torch.float32)
+            confidence_input = confidence_input.unsqueeze(0) * frame_mask.reshape(-1, 1)
+
         new_opt_vertices, new_opt_joints, new_opt_pose, new_opt_betas, \
-        new_opt_cam_t, new_opt_joint_loss = _smplify(
+        new_opt_cam_t, new_opt_joint_loss, report = _smplify(
             pred_pose.detach(),
             pred_betas.detach(),  # This will be zeros
             pred_cam_t.detach(),
             keypoints_3d,
             conf_3d=confidence_input.to(self.device),
             # seq_ind=idx
-            seq_ind=1 # exclude betas from grad
+            seq_ind=1, # exclude betas from grad
+            num_iters=num_iters,
+            guess_cam=init_params is None # warm starts keep their translation
         )
 
         thetas = new_opt_pose.reshape(self.batch_size, 24, 3)
@@ -97,4 +109,77 @@ class joints2smpl:
         root_loc = torch.cat([root_loc, torch.zeros_like(root_loc)], dim=-1).unsqueeze(1)  # [bs, 1, 6]
         thetas = torch.cat([thetas, root_loc], dim=1).unsqueeze(0).permute(0, 2, 3, 1)  # [1, 25, 6, 196]
         
-        return thetas.clone().detach(), {'pose': new_opt_joints[0, :24].flatten().clone().detach(), 'betas': new_opt_betas.clone().detach(), 'cam': new_opt_cam_t.clone().detach()}
+        print_fit_report(report, frame_mask)
+        return thetas.clone().detach(), {'pose': new_opt_pose.clone().detach(), 'betas': new_opt_betas.clone().detach(), 'cam': new_opt_cam_t.clone().detach(),
+                                         'joint_error': report['frame_joint_error'], 'report': report}
+
+    def joint2smpl_windowed(self, input_joints, frame_mask=None, window_overlap=8, warm_iters=30):
+        """Fit long sequences in overlapping windows, warm-starting each window from the previous one.
+
+        Args:
+            input_joints: [num_seqs, nframes, njoints, 3], num_seqs * window size must equal the batch size
+            frame_mask: optional [num_seqs, nframes] mask of valid frames
+            window_overlap: number of frames shared by consecutive windows
+            warm_iters: SMPLify iterations for warm-started windows
+        Returns:
+            thetas [1, 25, 6, num_seqs * nframes] and the opt dict, laid out like joint2smpl
+        """
+        num_seqs, num_frames, num_joints, _ = input_joints.shape
+        window_size = self.batch_size // num_seqs
+        assert num_seqs * window_size == self.batch_size and window_size <= num_frames
+
+        thetas = torch.zeros(1, 25, 6, num_seqs, num_frames, device=self.device)
+        pose = torch.zeros(num_seqs, num_frames, 72, device=self.device)
+        cam = torch.zeros(num_seqs, num_frames, 1, 3, device=self.device)
+        joint_error = torch.zeros(num_seqs, num_frames, device=self.device)
+
+        solved_end = 0
+        for start in get_window_starts(num_frames, window_size, window_overlap):
+            end = start + window_size
+            window_joints = input_joints[:, start:end].reshape(self.batch_size, num_joints, 3)
+            window_mask = None if frame_mask is None else frame_mask[:, start:end].reshape(-1)
+
+            if solved_end == 0:
+                window_thetas, window_opt = self.joint2smpl(window_joints, frame_mask=window_mask)
+                keep_from = start
+            else:
+                # solved frames reuse their solution, new frames start from the last solved frame
+                init_idx = torch.clamp(torch.arange(start, end, device=self.device), max=solved_end - 1)
+                init_params = {'pose': pose[:, init_idx].reshape(self.batch_size, 72),
+                               'cam': cam[:, init_idx].reshape(self.batch_size, 1, 3)}
+                window_thetas, window_opt = self.joint2smpl(window_joints, init_params=init_params,
+                                                            frame_mask=window_mask, num_iters=warm_iters)
+                # split the overlap between the previous and the current window
+                keep_from = (start + solved_end) // 2
+
+            offset = keep_from - start
+            thetas[..., keep_from:end] = window_thetas.reshape(1, 25, 6, num_seqs, window_size)[..., offset:]
+            pose[:, keep_from:end] = window_opt['pose'].reshape(num_seqs, window_size, 72)[:, offset:]
+            cam[:, keep_from:end] = window_opt['cam'].reshape(num_seqs, window_size, 1, 3)[:, offset:]
+            joint_error[:, keep_from:end] = window_opt['joint_error'].reshape(num_seqs, window_size)[:, offset:]
+            solved_end = end
+
+        return thetas.reshape(1, 25, 6, -1), {'pose': pose.reshape(-1, 72),
+                                              'betas': torch.zeros(num_seqs * num_frames, 10, device=self.device),
+                                              'cam': cam.reshape(-1, 1, 3),
+                                              'joint_error': joint_error.reshape(-1)}
+
+
+def print_fit_report(report, frame_mask=None):
+    """Print the iterations and convergence per stage and the per-frame joint error of a fit"""
+    error = report['frame_joint_error'] * 1000  # mm
+    if frame_mask is not None:
+        error = error[frame_mask.to(error.device) > 0]
+    if error.numel() == 0:
+        return
+    status = 'body stage converged' if report['body_converged'] else 'body budget exhausted'
+    print(f"SMPLify: {report['camera_iters']} camera + {report['body_iters']} body steps ({status}), "
+          f"joint error mean {error.mean():.1f} mm, max {error.max():.1f} mm over {error.numel()} frames")
+
+
+def get_window_starts(num_frames, window_size, window_overlap):
+    """Start frames of overlapping windows covering the sequence, the last one aligned to its end"""
+    if num_frames <= window_size:
+        return [0]
+    step = max(window_size - window_overlap, 1)
+    return list(range(0, num_frames - window_size, step)) + [num_frames - window_size]
@@ -3,18 +3,39 @@ import numpy as np
 import visualize.utils.rotation_conversions as geometry
 from visualize.rotation2xyz import Rotation2xyz
 from visualize.jnt2rot import joints2smpl
+from visualize.const import *
+
+
+def fit_joint_sequences(input_joints, frame_mask=None, device=None, window_size=None,
+                        window_overlap=SMPLIFY_WINDOW_OVERLAP, warm_iters=SMPLIFY_WARM_ITERS, **fitter_options):
+    """Run SMPLify on [num_seqs, nframes, njoints, 3] joints, optionally in warm-started windows.
+
+    fitter_options are passed to joints2smpl (iteration budgets and tolerances).
+    Returns thetas [1, 25, 6, num_seqs * nframes] and the opt dict of joints2smpl.
+    """
+    num_seqs, num_frames, num_joints, _ = input_joints.shape
+    if window_size is None or window_size >= num_frames:
+        j2s = joints2smpl(num_frames=num_seqs * num_frames, device=device, **fitter_options)
+        if frame_mask is not None:
+            frame_mask = frame_mask.reshape(-1)
+        return j2s.joint2smpl(input_joints.reshape(-1, num_joints, 3), frame_mask=frame_mask)
+    
+    j2s = joints2smpl(num_frames=num_seqs * window_size, device=device, **fitter_options)
+    return j2s.joint2smpl_windowed(input_joints, frame_mask=frame_mask,
+                                   window_overlap=window_overlap, warm_iters=warm_iters)
+
 
 class jnt2rot_wrapper:
-    def __init__(self, motion_dict, sample_idx, device=0, cuda=True):
+    def __init__(self, motion_dict, sample_idx, device=None, smplify_options=None):
         motion = motion_dict['motion']
         bs, njoints, nfeats, nframes = motion.shape
         assert nfeats == 3
         
         self.original_num_frames = motion[sample_idx].shape[-1]
-        j2s = joints2smpl(num_frames=self.original_num_frames, device_id=device, cuda=cuda)
         
         print(f'Running SMPLify For sample [{sample_idx}], it may take a few minutes.')
-        motion_tensor, opt_dict = j2s.joint2smpl(motion[sample_idx].transpose(2, 0, 1))  # [nframes, njoints, 3]
+        input_joints = motion[sample_idx].transpose(2, 0, 1)[None]  # [1, nframes, njoints, 3]
+        motion_tensor, opt_dict = fit_joint_sequences(input_joints, device=device, **(smplify_options or {}))
         self.opt_dict = opt_dict
         
         self.motion_tensor = self.format_motion(motion_tensor, opt_dict['cam'])
@@ -39,4 +60,56 @@ class jnt2rot_wrapper:
         return self.motion_tensor
     
     def get_opt_dict(self):
-        return self.opt_dict 
\ No newline at end of file
+        return self.opt_dict 
+
+class jnt2rot_batch_wrapper(jnt2rot_wrapper):
+    """Fit every sequence of a motion dict in a single SMPLify optimization.
+
+    All sequences are stacked along the batch dimension. Padded frames are
+    masked out of the joint loss and replaced by the last valid frame.
+    """
+    def __init__(self, motion_dict, device=None, smplify_options=None):
+        motion = motion_dict['motion']
+        bs, njoints, nfeats, nframes = motion.shape
+        assert nfeats == 3
+        
+        mask = motion_dict.get('mask', np.ones((bs, nframes), dtype=bool))
+        self.lengths = mask.sum(axis=1)
+        self.original_num_frames = nframes
+        
+        print(f'Running batched SMPLify for {bs} samples, it may take a few minutes.')
+        input_joints = motion.transpose(0, 3, 1, 2)  # [bs, nframes, njoints, 3]
+        motion_tensor, opt_dict = fit_joint_sequences(input_joints, frame_mask=mask, device=device,
+                                                      **(smplify_options or {}))
+        self.opt_dict = opt_dict
+        
+        motion_tensors = motion_tensor.reshape(1, 25, 6, bs, nframes).permute(3, 0, 1, 2, 4)  # [bs, 1, 25, 6, nframes]
+        cams = opt_dict['cam'].reshape(bs, nframes, 1, 3)
+        self.motion_tensors = []
+        for i in range(bs):
+            thetas = pad_frames(motion_tensors[i], self.lengths[i])
+            cam = pad_frames(cams[i].permute(1, 2, 0), self.lengths[i]).permute(2, 0, 1)
+            self.motion_tensors.append(self.format_motion(thetas, cam))
+        
+    def get_motion_tensor(self):
+        """All sequences stacked along the batch dimension, [bs, 25, 9, nframes] with padded tails"""
+        return torch.cat(self.motion_tensors, dim=0)
+    
+    def get_motion_tensors(self):
+        return self.motion_tensors
+
+
+def extend_frames(tensor, num_frames):
+    """Extend the last dimension to num_frames by repeating the last frame"""
+    num_missing = num_frames - tensor.shape[-1]
+    if num_missing <= 0:
+        return tensor
+    return torch.cat([tensor, tensor[..., -1:].expand(*tensor.shape[:-1], num_missing)], dim=-1)
+
+
+def pad_frames(tensor, num_valid):
+    """Repeat the last valid frame over the padded tail of the last dimension"""
+    num_valid = max(int(num_valid), 1)
+    tensor = tensor.clone()
+    tensor[..., num_valid:] = tensor[..., num_valid - 1:num_valid]
+    return tensor
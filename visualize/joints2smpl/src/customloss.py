@@ -1,4 +1,5 @@
 import torch
+import torch.nn as nn
 import torch.nn.functional as F
 from visualize.joints2smpl.src import config
 
@@ -12,13 +13,16 @@ def gmof(x, sigma):
     return (sigma_squared * x_squared) / (sigma_squared + x_squared)
 
 # angle prior
-def angle_prior(pose):
+def angle_prior(pose, signs=None):
     """
     Angle prior that penalizes unnatural bending of the knees and elbows
+    signs: optional prebuilt tensor of the bending directions, to avoid creating it per call
     """
+    if signs is None:
+        signs = torch.tensor([1., -1., -1, -1.], device=pose.device)
     # We subtract 3 because pose does not include the global rotation of the model
     return torch.exp(
-        pose[:, [55 - 3, 58 - 3, 12 - 3, 15 - 3]] * torch.tensor([1., -1., -1, -1.], device=pose.device)) ** 2
+        pose[:, [55 - 3, 58 - 3, 12 - 3, 15 - 3]] * signs) ** 2
 
 
 def perspective_projection(points, rotation, translation,
@@ -136,7 +140,9 @@ def body_fitting_loss_3d(body_pose, preserve_pose,
                          use_collision=False,
                          model_vertices=None, model_faces=None,
                          search_tree=None,  pen_distance=None,  filter_faces=None,
-                         collision_loss_weight=1000
+                         collision_loss_weight=1000,
+                         output='sum',
+                         angle_prior_signs=None
                          ):
     """
     Loss function for body fitting
@@ -153,7 +159,7 @@ def body_fitting_loss_3d(body_pose, preserve_pose,
     # Pose prior loss
     pose_prior_loss = (pose_prior_weight ** 2) * pose_prior(body_pose, betas)
     # Angle prior for knees and elbows
-    angle_prior_loss = (angle_prior_weight ** 2) * angle_prior(body_pose).sum(dim=-1)
+    angle_prior_loss = (angle_prior_weight ** 2) * angle_prior(body_pose, angle_prior_signs).sum(dim=-1)
     # Regularizer to prevent betas from taking large values
     shape_prior_loss = (shape_prior_weight ** 2) * (betas ** 2).sum(dim=-1)
 
@@ -185,7 +191,42 @@ def body_fitting_loss_3d(body_pose, preserve_pose,
 
     total_loss = joint3d_loss + pose_prior_loss + angle_prior_loss + shape_prior_loss + collision_loss + pose_preserve_loss
 
-    return total_loss.sum()
+    if output == 'sum':
+        return total_loss.sum()
+    elif output == 'frame':
+        return total_loss
+
+
+class BodyFittingLoss3D(nn.Module):
+    """
+    SMPL forward pass plus body_fitting_loss_3d without collisions, the LBFGS body closure in one module.
+    Index and sign constants are buffers, so the module can be compiled once and called every closure evaluation.
+    """
+    def __init__(self, smpl, pose_prior, smpl_index, joint_loss_weight=600.0, pose_preserve_weight=5.0):
+        super(BodyFittingLoss3D, self).__init__()
+        self.smpl = smpl
+        self.pose_prior = pose_prior
+        self.joint_loss_weight = joint_loss_weight
+        self.pose_preserve_weight = pose_preserve_weight
+        device = smpl.faces_tensor.device
+        self.register_buffer('smpl_index', torch.tensor(smpl_index, dtype=torch.long, device=device))
+        self.register_buffer('angle_prior_signs', torch.tensor([1., -1., -1, -1.], device=device))
+
+    def forward(self, global_orient, body_pose, betas, camera_translation, preserve_pose, j3d, joints3d_conf):
+        """
+        j3d: target joints already reordered to the SMPL joints of smpl_index
+        Returns the summed loss of all frames
+        """
+        smpl_output = self.smpl(global_orient=global_orient,
+                                body_pose=body_pose,
+                                betas=betas)
+        model_joints = smpl_output.joints[:, self.smpl_index]
+        return body_fitting_loss_3d(body_pose, preserve_pose, betas, model_joints, camera_translation,
+                                    j3d, self.pose_prior,
+                                    joints3d_conf=joints3d_conf,
+                                    joint_loss_weight=self.joint_loss_weight,
+                                    pose_preserve_weight=self.pose_preserve_weight,
+                                    angle_prior_signs=self.angle_prior_signs)
 
 
 # #####--- get camera fitting loss -----
@@ -148,6 +148,16 @@ class MaxMixturePrior(nn.Module):
         self.register_buffer('precisions',
                              torch.tensor(precisions, dtype=dtype))
 
+        # Lower triangular factors with precision = L L^T, so the
+        # Mahalanobis term is |d^T L|^2 for all components in one matmul
+        precisions64 = np.stack([np.linalg.inv(cov) for cov in
+                                 covs.astype(np.float64)])
+        precisions64 = 0.5 * (precisions64 +
+                              precisions64.transpose(0, 2, 1))
+        precision_factors = np.linalg.cholesky(precisions64)
+        self.register_buffer('precision_factors',
+                             torch.tensor(precision_factors, dtype=dtype))
+
         # The constant term:
         sqrdets = np.array([(np.sqrt(np.linalg.det(c)))
                             for c in gmm['covars']])
@@ -155,8 +165,13 @@ class MaxMixturePrior(nn.Module):
 
         nll_weights = np.asarray(gmm['weights'] / (const *
                                                    (sqrdets / sqrdets.min())))
+        # -log of the weights, taken in float64 once instead of per call
+        nll_log_weights = -np.log(nll_weights)
         nll_weights = torch.tensor(nll_weights, dtype=dtype).unsqueeze(dim=0)
         self.register_buffer('nll_weights', nll_weights)
+        self.register_buffer('nll_log_weights',
+                             torch.tensor(nll_log_weights,
+                                          dtype=dtype).unsqueeze(dim=0))
 
         weights = torch.tensor(gmm['weights'], dtype=dtype).unsqueeze(dim=0)
         self.register_buffer('weights', weights)
@@ -172,20 +187,29 @@ class MaxMixturePrior(nn.Module):
         # The dimensionality of the random variable
         self.random_var_dim = self.means.shape[1]
 
+        # Per component constant of the non-merged log-likelihood
+        self.register_buffer('component_consts', 0.5 * (
+            self.cov_dets + self.random_var_dim * self.pi_term))
+
     def get_mean(self):
         ''' Returns the mean of the mixture '''
         mean_pose = torch.matmul(self.weights, self.means)
         return mean_pose
 
-    def merged_log_likelihood(self, pose, betas):
+    def mahalanobis(self, pose):
+        ''' Returns the (B x M) squared Mahalanobis distances of the poses
+            to every mixture component
+        '''
         diff_from_mean = pose.unsqueeze(dim=1) - self.means
+        projected = torch.einsum('bmj,mji->bmi',
+                                 diff_from_mean, self.precision_factors)
+        return projected.pow(2).sum(dim=-1)
 
-        prec_diff_prod = torch.einsum('mij,bmj->bmi',
-                                      [self.precisions, diff_from_mean])
-        diff_prec_quadratic = (prec_diff_prod * diff_from_mean).sum(dim=-1)
+    def merged_log_likelihood(self, pose, betas):
+        diff_prec_quadratic = self.mahalanobis(pose)
 
-        curr_loglikelihood = 0.5 * diff_prec_quadratic - \
-            torch.log(self.nll_weights)
+        curr_loglikelihood = 0.5 * diff_prec_quadratic + \
+            self.nll_log_weights
         #  curr_loglikelihood = 0.5 * (self.cov_dets.unsqueeze(dim=0) +
         #  self.random_var_dim * self.pi_term +
         #  diff_prec_quadratic
@@ -197,31 +221,13 @@ class MaxMixturePrior(nn.Module):
     def log_likelihood(self, pose, betas, *args, **kwargs):
         ''' Create graph operation for negative log-likelihood calculation
         '''
-        likelihoods = []
-
-        for idx in range(self.num_gaussians):
-            mean = self.means[idx]
-            prec = self.precisions[idx]
-            cov = self.covs[idx]
-            diff_from_mean = pose - mean
-
-            curr_loglikelihood = torch.einsum('bj,ji->bi',
-                                              [diff_from_mean, prec])
-            curr_loglikelihood = torch.einsum('bi,bi->b',
-                                              [curr_loglikelihood,
-                                               diff_from_mean])
-            cov_term = torch.log(torch.det(cov) + self.epsilon)
-            curr_loglikelihood += 0.5 * (cov_term +
-                                         self.random_var_dim *
-                                         self.pi_term)
-            likelihoods.append(curr_loglikelihood)
-
-        log_likelihoods = torch.stack(likelihoods, dim=1)
-        min_idx = torch.argmin(log_likelihoods, dim=1)
-        weight_component = self.nll_weights[:, min_idx]
-        weight_component = -torch.log(weight_component)
-
-        return weight_component + log_likelihoods[:, min_idx]
+        log_likelihoods = self.mahalanobis(pose) + self.component_consts
+
+        # the weight and likelihood of each pose's own closest component
+        min_likelihood, min_idx = torch.min(log_likelihoods, dim=1)
+        weight_component = self.nll_log_weights[0, min_idx]
+
+        return weight_component + min_likelihood
 
     def forward(self, pose, betas):
         if self.use_merged:
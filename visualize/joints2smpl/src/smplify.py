@@ -4,14 +4,14 @@ import pickle
 import smplx
 import numpy as np
 
-sys.path.append(os.path.dirname(__file__))
-from customloss import (camera_fitting_loss, 
+from visualize.joints2smpl.src.customloss import (camera_fitting_loss, 
                         body_fitting_loss, 
                         camera_fitting_loss_3d,
                         body_fitting_loss_3d, 
                         )
-from prior import MaxMixturePrior
 from visualize.joints2smpl.src import config
+from visualize.device import resolve_device
+from visualize.model_registry import get_pose_prior, get_body_fitting_loss
 
 
 
@@ -40,6 +40,34 @@ def guess_init_3d(model_joints,
     return init_t
 
 
+def run_lbfgs(optimizer, closure, loss_fn, params, max_steps, ftol=0.0, gtol=0.0):
+    """Run LBFGS steps until the relative loss change or the gradient falls below tolerance.
+    Convergence is checked for the whole stage, i.e. the summed loss of all frames.
+    :param loss_fn: computes the stage loss without backward, used to get the loss after each step
+    :param max_steps: maximum number of optimizer.step calls
+    :param ftol: relative loss change between steps considered converged, 0 disables the check
+    :param gtol: max absolute gradient considered converged, 0 disables the check
+    :returns: number of steps taken and whether a tolerance was reached
+    """
+    prev_loss = None
+    for i in range(max_steps):
+        # step returns the loss before the step
+        loss = optimizer.step(closure)
+        if ftol > 0:
+            if prev_loss is None:
+                prev_loss = loss.item()
+            with torch.no_grad():
+                loss = loss_fn().item()
+            if abs(prev_loss - loss) <= ftol * max(abs(prev_loss), 1.0):
+                return i + 1, True
+            prev_loss = loss
+        if gtol > 0:
+            grads = [p.grad.abs().max() for p in params if p.grad is not None]
+            if grads and torch.stack(grads).max().item() <= gtol:
+                return i + 1, True
+    return max_steps, False
+
+
 # SMPLIfy 3D
 class SMPLify3D():
     """Implementation of SMPLify, use 3D joints."""
@@ -49,24 +77,35 @@ class SMPLify3D():
                  step_size=1e-2,
                  batch_size=1,
                  num_iters=100,
+                 num_cam_iters=10,
+                 max_inner_iters=20,
+                 max_cam_inner_iters=20,
+                 ftol=0.0,
+                 gtol=0.0,
                  use_collision=False,
                  use_lbfgs=True,
                  joints_category="orig",
-                 device=torch.device('cuda:0'),
+                 device=None,
+                 compile=False,
                  ):
 
         # Store options
         self.batch_size = batch_size
-        self.device = device
+        self.device = resolve_device(device)
         self.step_size = step_size
 
         self.num_iters = num_iters
+        self.num_cam_iters = num_cam_iters
+        # LBFGS iterations per step of the body and camera stages
+        self.max_inner_iters = max_inner_iters
+        self.max_cam_inner_iters = max_cam_inner_iters
+        # early stopping tolerances, 0 runs the full budget
+        self.ftol = ftol
+        self.gtol = gtol
         # --- choose optimizer
         self.use_lbfgs = use_lbfgs
         # GMM pose prior
-        self.pose_prior = MaxMixturePrior(prior_folder=config.GMM_MODEL_DIR,
-                                          num_gaussians=8,
-                                          dtype=torch.float32).to(device)
+        self.pose_prior = get_pose_prior(self.device, num_gaussians=8)
         # collision part
         self.use_collision = use_collision
         if self.use_collision:
@@ -91,8 +130,13 @@ class SMPLify3D():
             self.corr_index = None
             print("NO SUCH JOINTS CATEGORY!")
 
+        # SMPL forward plus body loss in one module, compiled once per batch size when requested
+        self.body_loss = None
+        if not self.use_collision and self.smpl_index is not None:
+            self.body_loss = get_body_fitting_loss(smplxmodel, self.pose_prior, self.smpl_index, compile=compile)
+
     # ---- get the man function here ------
-    def __call__(self, init_pose, init_betas, init_cam_t, j3d, conf_3d=1.0, seq_ind=0):
+    def __call__(self, init_pose, init_betas, init_cam_t, j3d, conf_3d=1.0, seq_ind=0, num_iters=None, guess_cam=True):
         """Perform body fitting.
         Input:
             init_pose: SMPL pose estimate
@@ -101,12 +145,16 @@ class SMPLify3D():
             j3d: joints 3d aka keypoints
             conf_3d: confidence for 3d joints
 			seq_ind: index of the sequence
+            num_iters: override of the body fitting iterations, e.g. for warm starts
+            guess_cam: estimate the translation from the torso instead of using init_cam_t
         Returns:
             vertices: Vertices of optimized shape
             joints: 3D joints of optimized shape
             pose: SMPL pose parameters of optimized shape
             betas: SMPL beta parameters of optimized shape
             camera_translation: Camera translation
+            final_loss: final fitting loss
+            report: iterations run per stage, whether they converged, per-frame loss and joint error
         """
 
         # # # add the mesh inter-section to avoid
@@ -148,8 +196,12 @@ class SMPLify3D():
                                 betas=betas)
         model_joints = smpl_output.joints
 
-        init_cam_t = guess_init_3d(model_joints, j3d, self.joints_category).unsqueeze(1).detach()
+        if guess_cam:
+            init_cam_t = guess_init_3d(model_joints, j3d, self.joints_category).unsqueeze(1).detach()
+        else:
+            init_cam_t = init_cam_t.reshape(-1, 1, 3).detach().clone()
         camera_translation = init_cam_t.clone()
+        num_iters = self.num_iters if num_iters is None else num_iters
         
         preserve_pose = init_pose[:, 3:].detach().clone()
        # -------------Step 1: Optimize camera translation and body orientation--------
@@ -162,25 +214,24 @@ class SMPLify3D():
         camera_opt_params = [global_orient, camera_translation]
 
         if self.use_lbfgs:
-            camera_optimizer = torch.optim.LBFGS(camera_opt_params, max_iter=self.num_iters,
+            camera_optimizer = torch.optim.LBFGS(camera_opt_params, max_iter=self.max_cam_inner_iters,
                                                  lr=self.step_size, line_search_fn='strong_wolfe')
-            for i in range(10):
-                def closure():
-                    camera_optimizer.zero_grad()
-                    smpl_output = self.smpl(global_orient=global_orient,
-                                            body_pose=body_pose,
-                                            betas=betas)
-                    model_joints = smpl_output.joints
-                    # print('model_joints', model_joints.shape)
-                    # print('camera_translation', camera_translation.shape)
-                    # print('init_cam_t', init_cam_t.shape)
-                    # print('j3d', j3d.shape)
-                    loss = camera_fitting_loss_3d(model_joints, camera_translation,
-                                                  init_cam_t, j3d, self.joints_category)
-                    loss.backward()
-                    return loss
-
-                camera_optimizer.step(closure)
+            def camera_loss():
+                smpl_output = self.smpl(global_orient=global_orient,
+                                        body_pose=body_pose,
+                                        betas=betas)
+                model_joints = smpl_output.joints
+                return camera_fitting_loss_3d(model_joints, camera_translation,
+                                              init_cam_t, j3d, self.joints_category)
+
+            def closure():
+                camera_optimizer.zero_grad()
+                loss = camera_loss()
+                loss.backward()
+                return loss
+
+            camera_steps, camera_converged = run_lbfgs(camera_optimizer, closure, camera_loss, camera_opt_params,
+                                                       self.num_cam_iters, self.ftol, self.gtol)
         else:
             camera_optimizer = torch.optim.Adam(camera_opt_params, lr=self.step_size, betas=(0.9, 0.999))
 
@@ -195,6 +246,7 @@ class SMPLify3D():
                 camera_optimizer.zero_grad()
                 loss.backward()
                 camera_optimizer.step()
+            camera_steps, camera_converged = 20, False
 
         # Fix camera translation after optimizing camera
         # --------Step 2: Optimize body joints --------------------------
@@ -212,33 +264,40 @@ class SMPLify3D():
             body_opt_params = [body_pose, global_orient, camera_translation]
 
         if self.use_lbfgs:
-            body_optimizer = torch.optim.LBFGS(body_opt_params, max_iter=self.num_iters,
+            body_optimizer = torch.optim.LBFGS(body_opt_params, max_iter=self.max_inner_iters,
                                                lr=self.step_size, line_search_fn='strong_wolfe')
-            for i in range(self.num_iters):
-                def closure():
-                    body_optimizer.zero_grad()
-                    smpl_output = self.smpl(global_orient=global_orient,
-                                            body_pose=body_pose,
-                                            betas=betas)
-                    model_joints = smpl_output.joints
-                    model_vertices = smpl_output.vertices
-
-                    loss = body_fitting_loss_3d(body_pose, preserve_pose, betas, model_joints[:, self.smpl_index], camera_translation,
-                                                j3d[:, self.corr_index], self.pose_prior,
-                                                joints3d_conf=conf_3d,
-                                                joint_loss_weight=600.0,
-                                                pose_preserve_weight=5.0,
-                                                use_collision=self.use_collision, 
-                                                model_vertices=model_vertices, model_faces=self.model_faces,
-                                                search_tree=search_tree, pen_distance=pen_distance, filter_faces=filter_faces)
-                    loss.backward()
-                    return loss
-
-                body_optimizer.step(closure)
+            j3d_corr = j3d[:, self.corr_index]
+            def pose_loss():
+                if self.body_loss is not None:
+                    return self.body_loss(global_orient, body_pose, betas, camera_translation,
+                                          preserve_pose, j3d_corr, conf_3d)
+                smpl_output = self.smpl(global_orient=global_orient,
+                                        body_pose=body_pose,
+                                        betas=betas)
+                model_joints = smpl_output.joints
+                model_vertices = smpl_output.vertices
+
+                return body_fitting_loss_3d(body_pose, preserve_pose, betas, model_joints[:, self.smpl_index], camera_translation,
+                                            j3d[:, self.corr_index], self.pose_prior,
+                                            joints3d_conf=conf_3d,
+                                            joint_loss_weight=600.0,
+                                            pose_preserve_weight=5.0,
+                                            use_collision=self.use_collision, 
+                                            model_vertices=model_vertices, model_faces=self.model_faces,
+                                            search_tree=search_tree, pen_distance=pen_distance, filter_faces=filter_faces)
+
+            def closure():
+                body_optimizer.zero_grad()
+                loss = pose_loss()
+                loss.backward()
+                return loss
+
+            body_steps, body_converged = run_lbfgs(body_optimizer, closure, pose_loss, body_opt_params,
+                                                   num_iters, self.ftol, self.gtol)
         else:
             body_optimizer = torch.optim.Adam(body_opt_params, lr=self.step_size, betas=(0.9, 0.999))
 
-            for i in range(self.num_iters):
+            for i in range(num_iters):
                 smpl_output = self.smpl(global_orient=global_orient,
                                         body_pose=body_pose,
                                         betas=betas)
@@ -255,6 +314,7 @@ class SMPLify3D():
                 body_optimizer.zero_grad()
                 loss.backward()
                 body_optimizer.step()
+            body_steps, body_converged = num_iters, False
 
         # Get final loss value
         with torch.no_grad():
@@ -264,16 +324,31 @@ class SMPLify3D():
             model_joints = smpl_output.joints
             model_vertices = smpl_output.vertices
 
-            final_loss = body_fitting_loss_3d(body_pose, preserve_pose, betas, model_joints[:, self.smpl_index], camera_translation,
+            frame_loss = body_fitting_loss_3d(body_pose, preserve_pose, betas, model_joints[:, self.smpl_index], camera_translation,
                                               j3d[:, self.corr_index], self.pose_prior,
                                               joints3d_conf=conf_3d,
                                               joint_loss_weight=600.0,
                                               use_collision=self.use_collision, model_vertices=model_vertices, model_faces=self.model_faces,
-                                              search_tree=search_tree,  pen_distance=pen_distance,  filter_faces=filter_faces)
+                                              search_tree=search_tree,  pen_distance=pen_distance,  filter_faces=filter_faces,
+                                              output='frame')
+            final_loss = frame_loss.sum()
+            # mean distance between fitted and target joints, per frame
+            frame_joint_error = ((model_joints[:, self.smpl_index] + camera_translation) -
+                                 j3d[:, self.corr_index]).norm(dim=-1).mean(dim=-1)
+
+        # convergence is tracked per stage for the whole batch, the frame entries are final values
+        report = {
+            'camera_iters': camera_steps,
+            'camera_converged': camera_converged,
+            'body_iters': body_steps,
+            'body_converged': body_converged,
+            'frame_loss': frame_loss.detach(),
+            'frame_joint_error': frame_joint_error.detach(),
+        }
 
         vertices = smpl_output.vertices.detach()
         joints = smpl_output.joints.detach()
         pose = torch.cat([global_orient, body_pose], dim=-1).detach()
         betas = betas.detach()
 
-        return vertices, joints, pose, betas, camera_translation, final_loss
+        return vertices, joints, pose, betas, camera_translation, final_loss, report
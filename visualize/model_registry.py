@@ -0,0 +1,104 @@
+import copy
+import torch
+import torch.nn as nn
+import smplx
+import h5py
+
+from visualize.device import resolve_device
+from visualize.smpl import SMPL
+from visualize.config import right_hand_pose, left_hand_pose
+from visualize.joints2smpl.src import config
+from visualize.joints2smpl.src.prior import MaxMixturePrior
+from visualize.joints2smpl.src.customloss import BodyFittingLoss3D
+
+# assets loaded once per process, keyed by (model type, gender, batch size, device, dtype)
+_models = {}
+
+
+def get_cached(key, build):
+    if key not in _models:
+        _models[key] = build()
+    return _models[key]
+
+
+def clear_models():
+    _models.clear()
+
+
+def get_smpl_layer(device=None, dtype=torch.float32):
+    """Shared neutral SMPL layer with the extra joint regressor, used by Rotation2xyz. Inputs are passed per call,
+    so one instance serves every batch size."""
+    device = resolve_device(device)
+    return get_cached(('smpl_layer', 'neutral', None, device, dtype),
+                      lambda: SMPL().eval().to(device=device, dtype=dtype))
+
+
+def get_smplx_model(batch_size, device=None, dtype=torch.float32, gender='neutral'):
+    """smplx SMPL body model with default parameters of the given batch size.
+
+    The model files are parsed once into a batch size 1 template. Other batch sizes are shallow
+    copies that share its buffers and only get their own batch-sized parameters.
+    """
+    device = resolve_device(device)
+    template = get_cached(('smplx', gender, 1, device, dtype),
+                          lambda: smplx.create(config.SMPL_MODEL_DIR,
+                                               model_type="smpl", gender=gender, ext="pkl", flat_hand_mean=False,
+                                               left_hand_pose=left_hand_pose, right_hand_pose=right_hand_pose,
+                                               batch_size=1, dtype=dtype).to(device))
+    if batch_size == 1:
+        return template
+    return get_cached(('smplx', gender, batch_size, device, dtype),
+                      lambda: resize_body_model(template, batch_size))
+
+
+def resize_body_model(template, batch_size):
+    model = copy.copy(template)
+    model._parameters = template._parameters.copy()
+    model._modules = template._modules.copy()
+    for name, param in template._parameters.items():
+        if param is not None and param.dim() > 0 and param.shape[0] == template.batch_size:
+            value = param.detach()[:1].expand(batch_size, *param.shape[1:]).clone()
+            model._parameters[name] = nn.Parameter(value, requires_grad=param.requires_grad)
+    model.batch_size = batch_size
+    return model
+
+
+def get_pose_prior(device=None, dtype=torch.float32, num_gaussians=8):
+    """Shared GMM pose prior"""
+    device = resolve_device(device)
+    return get_cached(('gmm', num_gaussians, None, device, dtype),
+                      lambda: MaxMixturePrior(prior_folder=config.GMM_MODEL_DIR,
+                                              num_gaussians=num_gaussians,
+                                              dtype=dtype).to(device))
+
+
+def get_body_fitting_loss(smpl, pose_prior, smpl_index, compile=False):
+    """Fused SMPL forward plus body loss of a cached body model, optionally compiled with torch.compile.
+
+    Compiled modules are kept with their model, so every SMPLify run of the same batch size reuses the
+    compiled code. The batch dimension is compiled as dynamic to avoid a recompilation per batch size.
+    """
+    device = smpl.faces_tensor.device
+    dtype = smpl.betas.dtype
+
+    def build():
+        loss = BodyFittingLoss3D(smpl, pose_prior, smpl_index)
+        if not compile:
+            return loss
+        if not hasattr(torch, 'compile'):
+            print("torch.compile is not available in this torch version, fitting without compilation")
+            return loss
+        return torch.compile(loss, dynamic=True)
+    return get_cached(('body_loss', tuple(smpl_index), smpl.batch_size, device, dtype, compile), build)
+
+
+def get_mean_params(device=None, dtype=torch.float32):
+    """Mean SMPL pose [1, 72] and shape [1, 10] used to initialize SMPLify"""
+    device = resolve_device(device)
+
+    def load():
+        with h5py.File(config.SMPL_MEAN_FILE, 'r') as file:
+            pose = torch.from_numpy(file['pose'][:]).unsqueeze(0).to(device=device, dtype=dtype)
+            shape = torch.from_numpy(file['shape'][:]).unsqueeze(0).to(device=device, dtype=dtype)
+        return pose, shape
+    return get_cached(('mean_params', 'neutral', 1, device, dtype), load)
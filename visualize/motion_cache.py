@@ -0,0 +1,72 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+from visualize.const import *
+
+# bump when the fitter output changes in a way the settings don't capture
+CACHE_VERSION = 2
+
+
+def sequence_key(joints, settings):
+    """Content hash of a joint sequence and the fitter settings used on it.
+
+    Args:
+        joints: array of shape (nframes, njoints, 3), without padding
+        settings: json-serializable dict of fitter settings
+    """
+    joints = np.ascontiguousarray(joints, dtype=np.float32)
+    digest = hashlib.sha1()
+    digest.update(f"v{CACHE_VERSION}{joints.shape}".encode())
+    digest.update(joints.tobytes())
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class motion_cache:
+    """Directory of fitted motion arrays keyed by content hash, with LRU eviction by size.
+
+    Entries are .npz files, so they load on any device. Reads refresh the
+    file mtime, which is used as the recency order for eviction.
+    """
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_SUFFIX)
+
+    def load(self, key):
+        path = self.get_path(key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as entry:
+            motion = entry['motion']
+        os.utime(path)
+        return motion
+
+    def save(self, key, motion):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.get_path(key)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, motion=np.asarray(motion, dtype=np.float32))
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        if self.max_bytes is None:
+            return
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(CACHE_SUFFIX) and not name.endswith('.tmp' + CACHE_SUFFIX):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
@@ -1,21 +1,22 @@
 import os
-import pickle
 import argparse
+import numpy as np
 import torch
-import utils.rotation_conversions as geometry
 import matplotlib.pyplot as plt
 
+from visualize.smooth import calculate_joint_accelerations
+
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-d', '--data_file', type=str, required=True)
+    parser.add_argument('-d', '--data_files', type=str, nargs='+', required=True, help='SMPLify cache entries (.npz)')
     return parser.parse_args()
 
-def load_motion_tensors(data_file):
-    with open(data_file, 'rb') as f:
-        data_dict = pickle.load(f)
-        motion_tensor_1_input, motion_tensor_2_input, motion_tensor_1_refine, motion_tensor_2_refine = data_dict
-    return (motion_tensor_1_input.cpu(), motion_tensor_2_input.cpu(), 
-            motion_tensor_1_refine.cpu(), motion_tensor_2_refine.cpu())
+def load_motion_tensors(data_files):
+    motion_tensors = []
+    for data_file in data_files:
+        with np.load(data_file) as entry:
+            motion_tensors.append(torch.from_numpy(entry['motion']))
+    return tuple(motion_tensors)
 
 def calculate_joint_angles(motion_tensor):
     thetas = motion_tensor[:, :-1] # [1, 24, 9, n]
@@ -25,32 +26,9 @@ def calculate_joint_angles(motion_tensor):
     n_frames = thetas.shape[-1]
     thetas = thetas.reshape(1, 24, 3, 3, n_frames)
 
-    # Calculate angle differences for all joints
-    accelerations = []
-    for joint_idx in range(24):
-        joint_rots = thetas[0, joint_idx] # [3, 3, n_frames]
-        joint_rots = joint_rots.permute(2, 0, 1) # [n_frames, 3, 3]
-        
-        # Calculate rotation differences R1^-1R2, R2^-1R3, etc
-        rot_diffs = []
-        for i in range(n_frames-1):
-            R1 = joint_rots[i]
-            R2 = joint_rots[i+1]
-            R1_inv = R1.transpose(0,1)
-            diff = torch.matmul(R1_inv, R2)
-            rot_diffs.append(diff)
-            
-        rot_diffs = torch.stack(rot_diffs) # [n_frames-1, 3, 3]
-        
-        # Convert to axis-angle and get magnitudes (velocities)
-        axis_angles = geometry.matrix_to_axis_angle(rot_diffs) # [n_frames-1, 3]
-        velocities = torch.norm(axis_angles, dim=1) # [n_frames-1]
-        
-        # Calculate acceleration as difference of velocities
-        accels = velocities[1:] - velocities[:-1] # [n_frames-2]
-        accelerations.append(accels)
-
-    return torch.stack(accelerations), n_frames-1 # [24, n_frames-2]
+    # Drop the zero padding at both ends
+    accelerations = calculate_joint_accelerations(thetas)[:, 1:-1]
+    return accelerations, n_frames-1 # [24, n_frames-2]
 
 def plot_angles(angles_list, n_frames_list, titles):
     fig, axs = plt.subplots(2, 2, figsize=(20, 16))
@@ -76,7 +54,7 @@ def plot_angles(angles_list, n_frames_list, titles):
 
 def main():
     args = parse_args()
-    motion_tensors = load_motion_tensors(args.data_file)
+    motion_tensors = load_motion_tensors(args.data_files)
     
     angles_list = []
     n_frames_list = []
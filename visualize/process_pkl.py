@@ -7,7 +7,11 @@ import torch
 from visualize.format_sequences import format_joint_sequences
 from visualize.converter_rot2obj import converter_rot2obj
 from visualize.converter_vf2obj import converter_vf2obj
-from visualize.jnt2rot_wrapper import jnt2rot_wrapper
+from visualize.converter_rigid2obj import converter_rigid2obj
+from visualize.jnt2rot_wrapper import jnt2rot_wrapper, jnt2rot_batch_wrapper, extend_frames
+from visualize.motion_cache import motion_cache, sequence_key
+from visualize.export import export_obj_sequences
+from visualize.rigid import fit_rigid_transforms, transforms_to_blender_coordinates
 from visualize.const import *
 
 
@@ -42,34 +46,104 @@ def setup_directories(data_file, keys_to_process):
     return output_dir, dirs
 
 
-def get_converters(data_dict, data_file, keys_to_process):
-    cache_dir = CACHE_DIR
-    cache_file = os.path.join(cache_dir, data_file.split('/')[-1].split('.')[0] + CACHE_SUFFIX)
+def fit_rigid_objects(data, keys_to_process, tolerance=RIGID_TOLERANCE):
+    """Rest mesh and transform track of each object vertex sequence that moves rigidly, {key: (rest, transforms)}"""
+    rigid = {}
+    for key in keys_to_process:
+        if 'obj_verts' not in key or key not in data:
+            continue
+        fit = fit_rigid_transforms(data[key], tolerance)
+        if fit is not None:
+            rigid[key] = fit
+            print(f"{key} moves rigidly, storing a rest mesh and {len(fit[1])} transforms")
+        else:
+            print(f"{key} deforms beyond {tolerance}, storing all vertices")
+    return rigid
+
+
+def get_smplify_options(smplify_options=None):
+    """SMPLify options with every unset entry filled from the SMPLIFY_* defaults, so equal fits get equal cache keys"""
+    options = {
+        'window_size': SMPLIFY_WINDOW_SIZE,
+        'window_overlap': SMPLIFY_WINDOW_OVERLAP,
+        'warm_iters': SMPLIFY_WARM_ITERS,
+        'num_iters': SMPLIFY_ITERS,
+        'num_cam_iters': SMPLIFY_CAM_ITERS,
+        'max_inner_iters': SMPLIFY_MAX_INNER_ITERS,
+        'max_cam_inner_iters': SMPLIFY_CAM_INNER_ITERS,
+        'ftol': SMPLIFY_FTOL,
+        'gtol': SMPLIFY_GTOL,
+        'compile': SMPLIFY_COMPILE,
+    }
+    options.update(smplify_options or {})
+    return options
+
+
+def fit_motion_tensors(sequences, batched=SMPLIFY_BATCHED, device=None, smplify_options=None):
+    """Run SMPLify on joint sequences of shape (si, 24, 3), returns unpadded [1, 25, 9, si] motion tensors"""
+    if batched:
+        motion_dict = format_joint_sequences(*sequences)
+        motion_tensors = jnt2rot_batch_wrapper(motion_dict, device=device, smplify_options=smplify_options).get_motion_tensors()
+    else:
+        motion_tensors = []
+        for seq in sequences:
+            motion_dict = format_joint_sequences(seq)
+            motion_tensor = jnt2rot_wrapper(motion_dict, sample_idx=0, device=device, smplify_options=smplify_options).get_motion_tensor()
+            motion_tensors.append(motion_tensor)
     
+    return [motion_tensor[..., :len(seq)] for motion_tensor, seq in zip(motion_tensors, sequences)]
+
+
+def get_converters(data_dict, data_file, keys_to_process, batched=SMPLIFY_BATCHED, device=None, smplify_options=None,
+                   interpolate_mode=INTERPOLATE_MODE, lazy=CONVERTER_LAZY, rigid=None):
     converters = {}
+    rigid = rigid or {}
     
     # Handle joint sequences
     joint_keys = [k for k in keys_to_process if 'jnts' in k]
     if joint_keys:
-        if os.path.exists(cache_file):
-            with open(cache_file, 'rb') as f:
-                motion_tensors = pickle.load(f)
+        cache = motion_cache()
+        smplify_options = get_smplify_options(smplify_options)
+        # compilation only changes how the fit runs, not its result
+        settings = {k: v for k, v in smplify_options.items() if k != 'compile'}
+        settings['batched'] = batched
+        sequences = [data_dict[key] for key in joint_keys]
+        if batched:
+            # one LBFGS run over the summed loss couples the sequences, so each result depends on the whole batch
+            settings['batch'] = [sequence_key(seq, {}) for seq in sequences]
+        cache_keys = [sequence_key(seq, settings) for seq in sequences]
+        motion_arrays = [cache.load(cache_key) for cache_key in cache_keys]
+        
+        # identical sequences share one entry, fit each missing one once
+        missing = list(dict.fromkeys(cache_keys[i] for i, motion in enumerate(motion_arrays) if motion is None))
+        if missing:
+            if batched:
+                # refit the batch the keys were computed on, not only its missing part
+                fit_keys, fit_sequences = cache_keys, sequences
+            else:
+                fit_keys = missing
+                fit_sequences = [sequences[cache_keys.index(cache_key)] for cache_key in missing]
+            fitted = {}
+            for cache_key, motion_tensor in zip(fit_keys, fit_motion_tensors(fit_sequences, batched, device, smplify_options)):
+                if cache_key not in fitted:
+                    fitted[cache_key] = motion_tensor.cpu().numpy()
+                    cache.save(cache_key, fitted[cache_key])
+            motion_arrays = [fitted[cache_key] if motion is None else motion
+                             for cache_key, motion in zip(cache_keys, motion_arrays)]
         else:
-            motion_tensors = []
-            for i, key in enumerate(joint_keys):
-                motion_tensor = jnt2rot_wrapper(data_dict, sample_idx=i, device=0, cuda=True).get_motion_tensor()
-                motion_tensors.append(motion_tensor)
-            
-            os.makedirs(cache_dir, exist_ok=True)
-            with open(cache_file, 'wb') as f:
-                pickle.dump(tuple(motion_tensors), f)
+            print(f"Loaded SMPLify results for {data_file} from {CACHE_DIR}")
         
-        for key, motion_tensor in zip(joint_keys, motion_tensors):
-            converters[key] = converter_rot2obj(motion_tensor, interpolate=INTERPOLATE, device=0, cuda=True)
+        num_frames = max(len(seq) for seq in sequences)
+        for key, motion in zip(joint_keys, motion_arrays):
+            motion_tensor = extend_frames(torch.from_numpy(motion), num_frames)
+            converters[key] = converter_rot2obj(motion_tensor, interpolate=INTERPOLATE, device=device,
+                                               interpolate_mode=interpolate_mode, lazy=lazy)
     
     obj_keys = [k for k in keys_to_process if 'obj_verts' in k]
     for key in obj_keys:
-        if key in data_dict:
+        if key in rigid:
+            converters[key] = converter_rigid2obj(*rigid[key], data_dict[KEY_OBJ_FACES], interpolate=INTERPOLATE)
+        elif key in data_dict:
             converters[key] = converter_vf2obj(data_dict[key], data_dict[KEY_OBJ_FACES], interpolate=INTERPOLATE)
     
     return converters
@@ -81,18 +155,50 @@ def convert_to_blender_coordinates(data):
     return data
 
 
-def save_obj_files(dirs, converters):
+def save_obj_files(dirs, converters, num_workers=EXPORT_WORKERS, pool=EXPORT_POOL):
+    sequences = {key: (converter, dirs[key]) for key, converter in converters.items() if key in dirs}
+    if sequences:
+        export_obj_sequences(sequences, num_workers=num_workers, pool=pool)
+
+
+def save_rigid_files(out_dir, converter, num_frames):
+    rest_path = os.path.join(out_dir, RIGID_REST_FILE_NAME)
+    transforms_path = os.path.join(out_dir, RIGID_TRANSFORMS_FILE_NAME)
+    faces_path = os.path.join(out_dir, FACES_FILE_NAME)
+    if all(os.path.exists(path) for path in [rest_path, transforms_path, faces_path]):
+        return
+    
+    np.save(rest_path, np.asarray(converter.rest_verts, dtype=np.float32))
+    np.save(faces_path, np.asarray(converter.get_faces(), dtype=np.int32))
+    # transforms last, the renderer only uses the rigid files once they exist
+    np.save(transforms_path + '.tmp.npy', converter.get_transform_range(0, num_frames).astype(np.float32))
+    os.replace(transforms_path + '.tmp.npy', transforms_path)
+    print(f"Saved a rest mesh and {num_frames} transforms to {out_dir}")
+
+
+def save_sequence_files(dirs, converters):
     num_frames = min([converter.num_frames for converter in converters.values()])
-    for frame_i in range(num_frames):
-        for key, converter in converters.items():
-            if key in dirs:
-                obj_path = os.path.join(dirs[key], f"frame_{frame_i:04d}.obj")
-                if not os.path.exists(obj_path):
-                    converter.save_obj(obj_path, frame_i)
+    for key, converter in converters.items():
+        if key not in dirs:
+            continue
+        if isinstance(converter, converter_rigid2obj):
+            save_rigid_files(dirs[key], converter, num_frames)
+            continue
+        sequence_path = os.path.join(dirs[key], SEQUENCE_FILE_NAME)
+        faces_path = os.path.join(dirs[key], FACES_FILE_NAME)
+        if os.path.exists(sequence_path) and os.path.exists(faces_path):
+            continue
         
-        progress = (frame_i + 1) / num_frames * 100
-        print(f"\rSaving obj files: [{('=' * int(progress/2)).ljust(50)}] {progress:.1f}%", end='', flush=True)
-    print()
+        first_frame = converter.get_vertex_array(0)
+        vertices = np.lib.format.open_memmap(sequence_path + '.tmp', mode='w+', dtype=np.float32,
+                                             shape=(num_frames,) + first_frame.shape)
+        for start, chunk in converter.iter_vertex_chunks(num_frames=num_frames):
+            vertices[start:start + len(chunk)] = chunk
+        vertices.flush()
+        del vertices
+        os.replace(sequence_path + '.tmp', sequence_path)
+        np.save(faces_path, np.asarray(converter.get_faces(), dtype=np.int32))
+        print(f"Saved {num_frames} frames to {sequence_path}")
 
 
 def save_info(output_dir, root_loc1, root_loc2):
@@ -110,7 +216,9 @@ def save_info(output_dir, root_loc1, root_loc2):
     np.save(info_path, info)
 
 
-def process_pkl_file(data_file, keys_to_process=None, skip_smplify=False):
+def process_pkl_file(data_file, keys_to_process=None, skip_smplify=False, batched=SMPLIFY_BATCHED, device=None, smplify_options=None,
+                     export_format=EXPORT_FORMAT, export_workers=EXPORT_WORKERS, export_pool=EXPORT_POOL,
+                     interpolate_mode=INTERPOLATE_MODE, lazy=CONVERTER_LAZY, rigid_compress=RIGID_COMPRESS):
     if keys_to_process is None:
         keys_to_process = [KEY_INPUT_P1_JNTS, KEY_INPUT_P2_JNTS, KEY_ORIGINAL_OBJ_VERTS,
                           KEY_REFINE_P1_JNTS, KEY_REFINE_P2_JNTS, KEY_FILTERED_OBJ_VERTS]
@@ -127,15 +235,23 @@ def process_pkl_file(data_file, keys_to_process=None, skip_smplify=False):
         if key not in data_dict:
             data_dict[key] = data[key]
     
+    # Store rigidly moving objects as a rest mesh and per-frame transforms
+    rigid = fit_rigid_objects(data, keys_to_process) if rigid_compress else {}
+    
     # Setup directories
     output_dir, dirs = setup_directories(data_file, keys_to_process)
     
     # Setup converters
     if not skip_smplify:
         print(f"Running SMPLify for {data_file}...")
-        converters = get_converters(data_dict, data_file, keys_to_process)
-        # Save obj files
-        save_obj_files(dirs, converters)
+        converters = get_converters(data_dict, data_file, keys_to_process, batched=batched, device=device,
+                                    smplify_options=smplify_options, interpolate_mode=interpolate_mode,
+                                    lazy=lazy, rigid=rigid)
+        # Save obj files or vertex sequences
+        if export_format == EXPORT_FORMAT_NPY:
+            save_sequence_files(dirs, converters)
+        else:
+            save_obj_files(dirs, converters, num_workers=export_workers, pool=export_pool)
         # Save trajectory info if we have p1/p2 input joints
         p1_keys = [k for k in converters.keys() if 'p1' in k.lower()]
         p2_keys = [k for k in converters.keys() if 'p2' in k.lower()]
@@ -161,7 +277,10 @@ def process_pkl_file(data_file, keys_to_process=None, skip_smplify=False):
     # Save data as npz file
     prim_npz_path = os.path.join(output_dir, PRIM_FILE_NAME)
     
-    npz_data = {key: convert_to_blender_coordinates(data[key]) for key in keys_to_process if key in data}
+    npz_data = {key: convert_to_blender_coordinates(data[key]) for key in keys_to_process if key in data and key not in rigid}
+    for key, (rest, transforms) in rigid.items():
+        npz_data[key + RIGID_REST_SUFFIX] = convert_to_blender_coordinates(rest.astype(np.float32))
+        npz_data[key + RIGID_TRANSFORMS_SUFFIX] = transforms_to_blender_coordinates(transforms).astype(np.float32)
     # npz_data = {key: data[key] for key in keys_to_process if key in data}
     npz_data[KEY_OBJ_FACES] = data[KEY_OBJ_FACES]
     np.savez(prim_npz_path, **npz_data)
@@ -0,0 +1,72 @@
+import numpy as np
+
+from visualize.const import *
+
+# this module is imported by the Blender scripts, keep it free of torch
+
+
+def fit_rigid_transforms(verts_list, tolerance=RIGID_TOLERANCE):
+    """Fit a rotation and translation per frame that maps frame 0 onto it (Kabsch).
+
+    Args:
+        verts_list: array of shape [F, V, 3]
+        tolerance: largest vertex distance the fit may leave on any frame
+    Returns:
+        (rest [V, 3], transforms [F, 4, 4]) in float64, None if the motion is not rigid
+    """
+    verts = np.asarray(verts_list, dtype=np.float64)
+    rest = verts[0]
+    rest_center = rest.mean(axis=0)
+    centers = verts.mean(axis=1)
+
+    covariance = np.einsum('vi,fvj->fij', rest - rest_center, verts - centers[:, None])
+    u, _, vt = np.linalg.svd(covariance)
+    # flip the smallest axis where the best orthogonal fit is a reflection
+    det = np.linalg.det(np.swapaxes(vt, 1, 2) @ np.swapaxes(u, 1, 2))
+    vt[:, 2] *= np.where(det < 0, -1.0, 1.0)[:, None]
+    rotations = np.swapaxes(vt, 1, 2) @ np.swapaxes(u, 1, 2)
+
+    transforms = np.tile(np.eye(4), (len(verts), 1, 1))
+    transforms[:, :3, :3] = rotations
+    transforms[:, :3, 3] = centers - rotations @ rest_center
+
+    error = np.linalg.norm(apply_rigid_transforms(rest, transforms) - verts, axis=-1).max()
+    if error > tolerance:
+        return None
+    return rest, transforms
+
+
+def apply_rigid_transforms(rest, transforms):
+    """Vertices [F, V, 3] of a rest mesh [V, 3] moved by transforms [F, 4, 4]"""
+    return np.einsum('fij,vj->fvi', transforms[:, :3, :3], rest) + transforms[:, None, :3, 3]
+
+
+def transforms_to_blender_coordinates(transforms):
+    """Y-up transforms [..., 4, 4] to Blender's Z-up, the (x, -z, y) axis change applied on both sides"""
+    transforms = np.array(transforms)[..., [0, 2, 1, 3], :][..., [0, 2, 1, 3]]
+    transforms[..., 1, :] *= -1
+    transforms[..., :, 1] *= -1
+    return transforms
+
+
+def matrix_to_quaternion(rotations):
+    """Unit quaternions (w, x, y, z) [F, 4] of rotation matrices [F, 3, 3], without sign flips between frames"""
+    m = np.asarray(rotations, dtype=np.float64)
+    m00, m01, m02 = m[:, 0, 0], m[:, 0, 1], m[:, 0, 2]
+    m10, m11, m12 = m[:, 1, 0], m[:, 1, 1], m[:, 1, 2]
+    m20, m21, m22 = m[:, 2, 0], m[:, 2, 1], m[:, 2, 2]
+    # each row is the quaternion scaled by 4 times one of its components, use the best conditioned one
+    candidates = np.stack([
+        np.stack([1 + m00 + m11 + m22, m21 - m12, m02 - m20, m10 - m01], axis=-1),
+        np.stack([m21 - m12, 1 + m00 - m11 - m22, m01 + m10, m02 + m20], axis=-1),
+        np.stack([m02 - m20, m01 + m10, 1 - m00 + m11 - m22, m12 + m21], axis=-1),
+        np.stack([m10 - m01, m02 + m20, m12 + m21, 1 - m00 - m11 + m22], axis=-1),
+    ], axis=1)
+    best = np.argmax(np.diagonal(candidates, axis1=1, axis2=2), axis=-1)
+    quaternions = candidates[np.arange(len(m)), best]
+    quaternions /= np.linalg.norm(quaternions, axis=-1, keepdims=True)
+
+    # q and -q are the same rotation, keep neighbouring frames on the same side for interpolation
+    flips = np.sum(quaternions[1:] * quaternions[:-1], axis=-1) < 0
+    signs = np.concatenate([[1.0], np.cumprod(np.where(flips, -1.0, 1.0))])
+    return quaternions * signs[:, None]
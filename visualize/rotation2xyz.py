@@ -6,23 +6,41 @@ import sys
 import visualize.utils.rotation_conversions as geometry
 
 
-from visualize.smpl import SMPL, JOINTSTYPE_ROOT
+from visualize.smpl import JOINTSTYPE_ROOT
+from visualize.device import resolve_device
+from visualize.model_registry import get_smpl_layer
 # from .get_model import JOINTSTYPES
 JOINTSTYPES = ["a2m", "a2mpl", "smpl", "vibe", "vertices"]
 
 
 class Rotation2xyz:
-    def __init__(self, device, dataset='amass'):
-        self.device = device
+    def __init__(self, device=None, dataset='amass'):
+        self.device = resolve_device(device)
         self.dataset = dataset
-        self.smpl_model = SMPL().eval().to(device)
+        self.smpl_model = get_smpl_layer(self.device)
 
     def __call__(self, x, mask, pose_rep, translation, glob,
                  jointstype, vertstrans, betas=None, beta=0,
-                 glob_rot=None, get_rotations_back=False, **kwargs):
+                 glob_rot=None, get_rotations_back=False, chunk_size=None, **kwargs):
         if pose_rep == "xyz":
             return x
 
+        # run long sequences through SMPL a chunk of frames at a time to bound peak memory,
+        # the rotations returned by get_rotations_back are sample-major so those calls run unchunked
+        if chunk_size is not None and x.shape[-1] > chunk_size and not get_rotations_back:
+            if mask is None:
+                mask = torch.ones((x.shape[0], x.shape[-1]), dtype=bool, device=x.device)
+            if betas is not None:
+                # one row per masked frame, laid out per sample and frame so chunks can slice them like the poses
+                frame_betas = betas.new_zeros(mask.shape + betas.shape[-1:])
+                frame_betas[mask] = betas
+            return torch.cat([self(x[..., start:start + chunk_size], mask[:, start:start + chunk_size],
+                                   pose_rep, translation, glob, jointstype, vertstrans,
+                                   betas=None if betas is None else
+                                   frame_betas[:, start:start + chunk_size][mask[:, start:start + chunk_size]],
+                                   beta=beta, glob_rot=glob_rot, **kwargs)
+                              for start in range(0, x.shape[-1], chunk_size)], dim=-1)
+
         if mask is None:
             mask = torch.ones((x.shape[0], x.shape[-1]), dtype=bool, device=x.device)
 
@@ -1,123 +1,145 @@
 import os
-import pickle
 import argparse
+import numpy as np
 import torch
+import torch.nn.functional as F
 import matplotlib.pyplot as plt
 import visualize.utils.rotation_conversions as geometry
+from visualize.const import *
+from visualize.converter import get_interpolation_indices
 
 def slerp(R1, R2, alpha):
-    R1_inv = R1.transpose(-2, -1)
-    R_diff = torch.matmul(R1_inv, R2)
-    axis_angle = geometry.matrix_to_axis_angle(R_diff)
-    angle = torch.norm(axis_angle, dim=-1, keepdim=True)
-    axis = axis_angle / (angle + 1e-7)
-    scaled_angle = angle * alpha
-    scaled_axis_angle = axis * scaled_angle
-    R_interp = geometry.axis_angle_to_matrix(scaled_axis_angle)
-    return torch.matmul(R1, R_interp)
+    return geometry.matrix_slerp(R1, R2, alpha)
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-d', '--data_file', type=str, required=True)
+    parser.add_argument('-d', '--data_files', type=str, nargs='+', required=True, help='SMPLify cache entries (.npz)')
     return parser.parse_args()
 
-def load_motion_tensors(data_file):
-    with open(data_file, 'rb') as f:
-        data_dict = pickle.load(f)
-        motion_tensor_1_input, motion_tensor_2_input, motion_tensor_1_refine, motion_tensor_2_refine = data_dict
-    return (motion_tensor_1_input.cpu(), motion_tensor_2_input.cpu(), 
-            motion_tensor_1_refine.cpu(), motion_tensor_2_refine.cpu())
+def load_motion_tensors(data_files):
+    motion_tensors = []
+    for data_file in data_files:
+        with np.load(data_file) as entry:
+            motion_tensors.append(torch.from_numpy(entry['motion']))
+    return tuple(motion_tensors)
+
+def relative_rotation_angles(rotations):
+    """Angle of R_t^T R_{t+1} between consecutive frames, for all leading dims at once.
+
+    Args:
+        rotations: rotation matrices of shape (..., n_frames, 3, 3)
+    Returns:
+        angles in radians of shape (..., n_frames-1)
+    """
+    rot_diffs = torch.matmul(rotations[..., :-1, :, :].transpose(-2, -1), rotations[..., 1:, :, :])
+
+    # cos from the trace, sin from the skew-symmetric part, atan2 stays accurate near 0 and pi
+    cos = (rot_diffs.diagonal(dim1=-2, dim2=-1).sum(-1) - 1) / 2
+    skew = torch.stack([rot_diffs[..., 2, 1] - rot_diffs[..., 1, 2],
+                        rot_diffs[..., 0, 2] - rot_diffs[..., 2, 0],
+                        rot_diffs[..., 1, 0] - rot_diffs[..., 0, 1]], dim=-1)
+    sin = torch.norm(skew, dim=-1) / 2
+    return torch.atan2(sin, cos)
 
 def calculate_joint_accelerations(thetas):
-    n_frames = thetas.shape[-1]
-    # Calculate angle differences for all joints
-    accelerations = []
-    for joint_idx in range(24):
-        joint_rots = thetas[0, joint_idx] # [3, 3, n_frames]
-        joint_rots = joint_rots.permute(2, 0, 1) # [n_frames, 3, 3]
-        
-        # Calculate rotation differences R1^-1R2, R2^-1R3, etc
-        rot_diffs = []
-        for i in range(n_frames-1):
-            R1 = joint_rots[i]
-            R2 = joint_rots[i+1]
-            R1_inv = R1.transpose(0,1)
-            diff = torch.matmul(R1_inv, R2)
-            rot_diffs.append(diff)
-            
-        rot_diffs = torch.stack(rot_diffs) # [n_frames-1, 3, 3]
-        
-        # Convert to axis-angle and get magnitudes (velocities)
-        axis_angles = geometry.matrix_to_axis_angle(rot_diffs) # [n_frames-1, 3]
-        velocities = torch.norm(axis_angles, dim=1) # [n_frames-1]
-        
-        # Calculate acceleration as difference of velocities
-        accels = velocities[1:] - velocities[:-1] # [n_frames-2]
-        
-        # Pad with zeros at start and end
-        accels = torch.cat(
-            [torch.zeros(1).to(accels.device),
-             accels,
-             torch.zeros(1).to(accels.device)])
-        accelerations.append(accels)
-
-    return torch.stack(accelerations) # [24, n_frames]
-
-def get_jerk_intervals(accelerations, thereshold = 1.0, expand_frames = 1):
-    n_frames = accelerations.shape[1]
-    intervals = []
-    start_idx = None
-    last_idx = None
-    frames_since_last = 0
-    
-    # Find intervals in a single pass
-    for i in range(n_frames):
-        # Check if any joint exceeds threshold
-        if torch.any(torch.abs(accelerations[:,i]) > thereshold):
-            if start_idx is None:
-                start_idx = i
-            frames_since_last = 0
-            last_idx = i
-        elif frames_since_last > expand_frames and start_idx is not None:
-            intervals.append([start_idx, last_idx])
-            start_idx = None
-        frames_since_last += 1
-            
-    # Handle final interval if exists
-    if start_idx is not None:
-        intervals.append([start_idx, last_idx])
-        
-    return intervals
+    joint_rots = thetas[0].permute(0, 3, 1, 2) # [24, n_frames, 3, 3]
+    velocities = relative_rotation_angles(joint_rots) # [24, n_frames-1]
+
+    # Calculate acceleration as difference of velocities, padded with zeros at start and end
+    accels = velocities[:, 1:] - velocities[:, :-1] # [24, n_frames-2]
+    return F.pad(accels, (1, 1)) # [24, n_frames]
 
-def smooth_motion(motion_tensor):
+def get_mask_intervals(mask, expand_frames=0):
+    """Group the set frames of a mask into [first, last] intervals.
+
+    Args:
+        mask: bool tensor of shape (n_frames,)
+        expand_frames: set frames separated by at most this many unset frames are merged
+    Returns:
+        list of [start, end] frame indices, inclusive
+    """
+    frames = torch.nonzero(mask).flatten()
+    if len(frames) == 0:
+        return []
+
+    # a new interval starts wherever the gap to the previous set frame is too large
+    breaks = torch.nonzero(torch.diff(frames) > expand_frames + 1).flatten()
+    starts = torch.cat([frames[:1], frames[breaks + 1]])
+    ends = torch.cat([frames[breaks], frames[-1:]])
+    return torch.stack([starts, ends], dim=1).tolist()
+
+def get_jerk_intervals(accelerations, threshold=SMOOTH_JERK_THRESHOLD, expand_frames=SMOOTH_EXPAND_FRAMES):
+    # Frames where any joint exceeds threshold, computed once for all frames
+    exceeds = torch.any(torch.abs(accelerations) > threshold, dim=0)
+    return get_mask_intervals(exceeds, expand_frames)
+
+def smooth_motion(motion_tensor, threshold=SMOOTH_JERK_THRESHOLD, expand_frames=SMOOTH_EXPAND_FRAMES):
     thetas = motion_tensor[:, :-1] # [1, 24, 9, n]
     _, n_joints, _, n_frames = thetas.shape
     
     thetas = thetas.reshape(1, n_joints, 3, 3, n_frames)
     accelerations = calculate_joint_accelerations(thetas)
-    intervals = get_jerk_intervals(accelerations)
+    intervals = get_jerk_intervals(accelerations, threshold, expand_frames)
     
     smoothed_motion = thetas.clone()
     
+    # Gather every in-between frame of every interval, with its key frames and weight
+    frames, prev_frames, next_frames, alphas = [], [], [], []
     for interval in intervals:
         start, end = interval
         # prevent out of bounds, but not gonna happen
         if start == 0: start += 1
         if end == n_frames - 1: end -= 1
+        if start > end:
+            continue
         
-        for i in range(start, end+1):
-            alpha = (i - start + 1) / (end - start + 2)
-            # smoothed_motion[0, :, :, :, i] = thetas[0, :, :, :, start-1]
-            smoothed_motion[0, :, :, :, i] = slerp(thetas[0, :, :, :, start-1], thetas[0, :, :, :, end+1], alpha)
+        interval_frames = torch.arange(start, end+1)
+        frames.append(interval_frames)
+        prev_frames.append(torch.full_like(interval_frames, start-1))
+        next_frames.append(torch.full_like(interval_frames, end+1))
+        alphas.append((interval_frames - start + 1) / (end - start + 2))
+    
+    if frames:
+        frames = torch.cat(frames).to(thetas.device)
+        alphas = torch.cat(alphas).to(thetas.device, thetas.dtype)
+        key_rots = thetas[0].permute(3, 0, 1, 2) # [n_frames, 24, 3, 3]
+        # Slerp all frames of all intervals in one call
+        interp = slerp(key_rots[torch.cat(prev_frames).to(thetas.device)],
+                       key_rots[torch.cat(next_frames).to(thetas.device)],
+                       alphas[:, None]) # [n_interp, 24, 3, 3]
+        smoothed_motion[0, :, :, :, frames] = interp.permute(1, 2, 3, 0)
     
     smoothed_motion = smoothed_motion.reshape(1, n_joints, 9, n_frames)
     smoothed_motion = torch.cat([smoothed_motion, motion_tensor[:,-1:]], dim=1)  # [1, 25, 9, n]
     
     return smoothed_motion
 
+def upsample_motion(motion_tensor, factor):
+    """Resample a motion in rotation space, slerping joint rotations and lerping the root.
+
+    Args:
+        motion_tensor: [1, 25, 9, n] rotation matrices with the root location in the last row
+        factor: any positive float, the output has int(n * factor) frames
+    Returns:
+        [1, 25, 9, int(n * factor)] motion tensor
+    """
+    n_frames = motion_tensor.shape[-1]
+    idx0, idx1, alpha = get_interpolation_indices(0, int(n_frames * factor), factor, n_frames)
+    idx0 = torch.from_numpy(idx0).to(motion_tensor.device)
+    idx1 = torch.from_numpy(idx1).to(motion_tensor.device)
+    alpha = torch.from_numpy(alpha).to(motion_tensor)
+
+    thetas = motion_tensor[0, :-1].reshape(-1, 3, 3, n_frames).permute(3, 0, 1, 2) # [n, 24, 3, 3]
+    thetas = slerp(thetas[idx0], thetas[idx1], alpha[:, None]) # [m, 24, 3, 3]
+    thetas = thetas.permute(1, 2, 3, 0).reshape(1, -1, 9, len(alpha))
+
+    root_loc = motion_tensor[:, -1:]
+    root_loc = root_loc[..., idx0] + alpha * (root_loc[..., idx1] - root_loc[..., idx0])
+    return torch.cat([thetas, root_loc], dim=1)
+
 def main():
     args = parse_args()
-    motion_tensors = load_motion_tensors(args.data_file)
+    motion_tensors = load_motion_tensors(args.data_files)
     
     angles_list = []
     intervals_list = []
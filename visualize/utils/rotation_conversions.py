@@ -551,47 +551,52 @@ def matrix_to_rotation_6d(matrix: torch.Tensor) -> torch.Tensor:
     """
     return matrix[..., :2, :].clone().reshape(*matrix.size()[:-2], 6)
 
-def matrix_slerp(matrix1: torch.Tensor, matrix2: torch.Tensor, t: float) -> torch.Tensor:
+def quaternion_slerp(quat1: torch.Tensor, quat2: torch.Tensor, t) -> torch.Tensor:
     """
-    Performs spherical linear interpolation (SLERP) between two rotation matrices.
-    
+    Performs spherical linear interpolation (SLERP) between quaternions,
+    along the shortest path. Nearly identical pairs are linearly interpolated.
+
     Args:
-        matrix1: First rotation matrix of shape (..., 3, 3)
-        matrix2: Second rotation matrix of shape (..., 3, 3) 
-        t: Interpolation weight between [0,1], scalar value
+        quat1: quaternions with real part first, as tensor of shape (..., 4).
+        quat2: quaternions with real part first, as tensor of shape (..., 4).
+        t: Interpolation weights between [0,1], a scalar or a tensor
+            broadcastable to (...).
 
     Returns:
-        Interpolated rotation matrix of shape (..., 3, 3)
+        Interpolated unit quaternions as tensor of shape (..., 4).
     """
-    # Convert matrices to quaternions
-    quat1 = matrix_to_quaternion(matrix1)
-    quat2 = matrix_to_quaternion(matrix2)
-    
-    # Calculate dot product between quaternions
-    dot = (quat1 * quat2).sum(-1, keepdim=True)
-    
+    t = torch.as_tensor(t, dtype=quat1.dtype, device=quat1.device)[..., None]
+
     # If dot product is negative, flip second quaternion
     # This ensures we take the shortest path
+    dot = (quat1 * quat2).sum(-1, keepdim=True)
     quat2 = torch.where(dot < 0, -quat2, quat2)
-    dot = torch.where(dot < 0, -dot, dot)
-    
+    dot = dot.abs()
+
     # If quaternions are very close, linearly interpolate
     DOT_THRESHOLD = 0.9995
     linear_interp = dot > DOT_THRESHOLD
+
+    theta = torch.acos(dot.clamp(max=1.0))
+    sin_theta = torch.where(linear_interp, torch.ones_like(dot), torch.sin(theta))
+    s1 = torch.where(linear_interp, 1.0 - t, torch.sin((1.0 - t) * theta) / sin_theta)
+    s2 = torch.where(linear_interp, t, torch.sin(t * theta) / sin_theta)
+
+    return F.normalize(s1 * quat1 + s2 * quat2, dim=-1)
+
+def matrix_slerp(matrix1: torch.Tensor, matrix2: torch.Tensor, t) -> torch.Tensor:
+    """
+    Performs spherical linear interpolation (SLERP) between two rotation matrices.
     
-    if linear_interp.any():
-        # Linear interpolation
-        result = quat1 + t * (quat2 - quat1)
-        result = F.normalize(result, dim=-1)
-    else:
-        # Spherical interpolation
-        theta = torch.acos(dot.clamp(-1, 1))
-        sin_theta = torch.sin(theta)
-        
-        s1 = torch.sin((1.0 - t) * theta) / sin_theta
-        s2 = torch.sin(t * theta) / sin_theta
-        
-        result = s1 * quat1 + s2 * quat2
-    
-    # Convert interpolated quaternion back to matrix
-    return quaternion_to_matrix(result)
\ No newline at end of file
+    Args:
+        matrix1: First rotation matrix of shape (..., 3, 3)
+        matrix2: Second rotation matrix of shape (..., 3, 3) 
+        t: Interpolation weights between [0,1], a scalar or a tensor
+            broadcastable to (...)
+
+    Returns:
+        Interpolated rotation matrix of shape (..., 3, 3)
+    """
+    quat1 = matrix_to_quaternion(matrix1)
+    quat2 = matrix_to_quaternion(matrix2)
+    return quaternion_to_matrix(quaternion_slerp(quat1, quat2, t))
\ No newline at end of file
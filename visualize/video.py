@@ -0,0 +1,54 @@
+import os
+import shutil
+import subprocess
+
+from visualize.const import *
+
+
+def get_frame_dirs(video_dir, video_prefix):
+    """Rendered frame directories of one target, {video path: frames dir}.
+
+    Only the exact <prefix>_<camera>_frames names of the known cameras match, so a prefix
+    such as "gt" never picks up the frames of "gt_input".
+    """
+    frame_dirs = {}
+    for _, camera_text in camera_params:
+        video_path = os.path.join(video_dir, f"{video_prefix}_{camera_text}{VIDEO_EXT}")
+        frames_dir = os.path.splitext(video_path)[0] + FRAMES_DIR_SUFFIX
+        if os.path.isdir(frames_dir):
+            frame_dirs[video_path] = frames_dir
+    return frame_dirs
+
+
+def encode_image_sequence(frames_dir, video_path, fps=VIDEO_FPS):
+    """Encode frame_0001.png, frame_0002.png, ... into an H.264 video with ffmpeg"""
+    # encode under a temporary name so an interrupted encode never looks finished
+    partial_path = os.path.splitext(video_path)[0] + PARTIAL_SUFFIX + VIDEO_EXT
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-framerate", str(fps),
+        "-start_number", "1",
+        "-i", os.path.join(frames_dir, FRAME_FILE_PREFIX + "%04d" + FRAME_FILE_EXT),
+        "-c:v", "libx264", "-pix_fmt", "yuv420p",
+        partial_path,
+    ]
+    subprocess.run(cmd, check=True)
+    os.replace(partial_path, video_path)
+    return video_path
+
+
+def encode_frame_dirs(video_dir, video_prefix, fps=VIDEO_FPS, keep_frames=RENDER_KEEP_FRAMES):
+    """Encode every rendered frame directory of one target into its video, skipping existing videos.
+
+    Frame directories of finished videos are removed unless keep_frames is set, including ones
+    left behind by a run interrupted between encoding and cleanup.
+    """
+    videos = []
+    for video_path, frames_dir in get_frame_dirs(video_dir, video_prefix).items():
+        if not os.path.exists(video_path):
+            encode_image_sequence(frames_dir, video_path, fps)
+            print(f"Encoded {frames_dir} to {video_path}")
+            videos.append(video_path)
+        if not keep_frames:
+            shutil.rmtree(frames_dir)
+    return videos